@@ -3,105 +3,415 @@
     # We can have seperate files like api/events.py - api/users.py - api/payments.py, having their own routers defined in them, and we simply import and plug into our main application file (main.py) - this keeps code modular and organised. rather than writing all endpoints in main.py
 # BackgroundTasks: is a fastapi feature that lets you run tasks in the background after sending a response to the user. This is useful for things that take time, like sending emails or processing data, so the user doesn't have to wait for these tasks to finish before getting a response.
 
-from fastapi import APIRouter, BackgroundTasks, HTTPException
-from sqlalchemy.orm import Session
-from app.db.session import SessionLocal
+import asyncio
+import base64
+import binascii
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, Query, Request
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import settings
+from app.db.session import AsyncSessionLocal, get_async_db
 from app.db.models import Event, EventStatus
-from app.services.processor import process_event
+from app.services.cache import event_cache, recent_idempotency_keys
+from app.services.event_ids import event_lookup, new_event_id
+from app.services.ingest import MAX_BATCH_SIZE, MAX_IDEMPOTENCY_KEY_LENGTH, insert_events, parse_batch_body, validate_batch_item
+from app.services.notifications import event_notifier
+from app.services.processor import process_event_in_background, process_events_in_background, redrive_dead_letters
+from app.services.rollups import GRANULARITIES, MAX_BUCKETS, stats_query, summarize
+from app.services.rules import extract_hot_field
 from uuid import UUID
 
 # we define this router for events-related endpoints. 
 router = APIRouter()
 
+# statuses after which processing of an event is over
+FINISHED_STATUSES = (EventStatus.completed, EventStatus.failed, EventStatus.dead_letter)
+
+# every endpoint here is async def and gets its AsyncSession from the get_async_db dependency. while a request awaits postgres the event loop keeps serving others,
+# so the number of in-flight requests per worker is no longer capped by the size of starlette's thread pool.
+
 # HTTP POST endpoint to create a new event: POST /events/.  will call create_event function when this endpoint is hit.
+# producers retry on timeouts, so they can send an Idempotency-Key header: a repeated submission with the same key returns the original event_id and its
+# current status ("duplicate": true) instead of creating and processing the event a second time.
 @router.post("/")
-def create_event(
+async def create_event(
     event_type: str,
     payload: dict,
-    background_tasks: BackgroundTasks
-):
-    # Create a DB session using SessionLocal(),and tell everyone that this object is of type Session. This will be created at endpoints only so same session created at endpoint be used for the requests via this and not in the seperate functions so the same session isnt shared across multiple requests.
+    background_tasks: BackgroundTasks,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", min_length=1, max_length=MAX_IDEMPOTENCY_KEY_LENGTH),
+    # Depends(get_async_db) gives this request its own session and closes it after the response. The session is created per request and never in the seperate functions so the same session isnt shared across multiple requests.
         # why because session is a temporary conversation setup so if the same chat is shared across multiple requests by diff users if present in a function, it can mix up one users rqst to db with other users rqst, say if one says d.add() and other says db.delete() - this can cause data corruption - 
         # so we shall have one session per request created at endpoint level and passed to other functions as needed.
-    db: Session = SessionLocal()
+    db: AsyncSession = Depends(get_async_db)
+):
+    if idempotency_key is not None:
+        return await _create_event_once(event_type, payload, idempotency_key, background_tasks, db)
 
     try:
     # we are creating a new event object with the provided event_type and payload. The status is set to queued by default.
     # and this object is added to the database session, committed (saved to the database), that reflects as row in db.
+    # event_id is generated in python, so unlike before there is no need to refresh the object from the db after commit.
+        hot_field, hot_value = extract_hot_field(event_type, payload)
+        # the id is derived from created_at (see app/services/event_ids.py), so both are set here instead of by the column defaults
+        created_at = datetime.utcnow()
         event = Event(
+            event_id=new_event_id(created_at),
+            created_at=created_at,
             event_type=event_type,
             status=EventStatus.queued,
-            payload=payload
+            payload=payload,
+            hot_field=hot_field,
+            hot_value=hot_value
         )
 
         db.add(event)
-        db.commit()
-        db.refresh(event)
+        await db.commit()
 
-        # After the event is created and saved in the database, we add a background task to process the event. This means that the process_event function will be called with the event's ID and the database session, but it will run in the background after the response is sent to the user.
-        background_tasks.add_task(process_event, event.event_id, db)
+        # After the event is created and saved in the database, we add a background task to process the event. It runs with its own db session in the background after the response is sent to the user.
+        # in "worker" mode we skip this, the event stays queued in the db and a `python -m app.worker` process picks it up instead.
+        if settings.processing_mode == "background":
+            background_tasks.add_task(process_event_in_background, event.event_id)
 
         # we send the response immedietly to the user with the event ID and its status - wont wait for background process to complete - Runs asynchronously
         return {
             "event_id": event.event_id,
-            "status": event.status
+            "status": event.status,
+            "duplicate": False
         }
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
-    
 
-# HTTP GET endpoint to retrieve an event by its ID: GET /events/{event_id}, will call get_event function when this endpoint is hit.
-@router.get("/{event_id}")
-def get_event(event_id: UUID):
-    db: Session = SessionLocal()
-    
+
+async def _create_event_once(event_type: str, payload: dict, idempotency_key: str, background_tasks: BackgroundTasks, db: AsyncSession):
+    # most retries come back to the process that took the first attempt within seconds, so the recent-keys cache answers them without any db write
+    recent = recent_idempotency_keys.get(idempotency_key)
+    if recent is not None:
+        event_id, created_at = recent
+        return {"event_id": event_id, "status": await _current_status(db, event_id, created_at), "duplicate": True}
+
     try:
-        event = db.query(Event).filter(Event.event_id == event_id).first()
+        # the db decides for keys this process hasn't seen: the key is inserted with ON CONFLICT DO NOTHING and the event only when the key was new
+        (ingested,) = await db.run_sync(
+            insert_events, [{"event_type": event_type, "payload": payload, "idempotency_key": idempotency_key}]
+        )
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
 
-        if not event:
-            raise HTTPException(status_code=404, detail="Event not found")
+    recent_idempotency_keys.set(idempotency_key, (ingested.event_id, ingested.created_at))
 
-        return {
-            "event_id": event.event_id,
-            "event_type": event.event_type,
-            "status": event.status,
-            "payload": event.payload,
-            "error_message": event.error_message
-        }
+    if not ingested.duplicate and settings.processing_mode == "background":
+        background_tasks.add_task(process_event_in_background, ingested.event_id)
+
+    return {"event_id": ingested.event_id, "status": ingested.status, "duplicate": ingested.duplicate}
+
+
+async def _current_status(db: AsyncSession, event_id: UUID, created_at: datetime):
+    cached = event_cache.get(event_id)
+    if cached is not None:
+        return cached["status"]
+
+    try:
+        # with created_at in the filter postgres reads a single partition
+        return (
+            await db.execute(select(Event.status).where(Event.event_id == event_id, Event.created_at == created_at))
+        ).scalar_one_or_none()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    
-    finally:
-        db.close()
+
+
+# HTTP POST endpoint to create many events in one request: POST /events/batch. Body is either a JSON array of {"event_type", "payload", "source", "idempotency_key"} objects
+# or NDJSON (one object per line). all valid events are written with multi-row INSERTs in a single transaction and handed to processing as one batch, and every item gets
+# its own status back in the response. items whose idempotency_key was seen before are not inserted again, they report the original event with "duplicate": true.
+@router.post("/batch")
+async def create_events_batch(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_async_db)
+):
+    try:
+        items = parse_batch_body(await request.body(), request.headers.get("content-type", ""))
+    except ValueError as e:
+        # json.JSONDecodeError is a ValueError too, so malformed bodies land here
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {MAX_BATCH_SIZE} events")
+
+    # validate every item up front, bad items are reported back as rejected instead of failing the whole batch
+    results = []
+    rows = []
+    for index, item in enumerate(items):
+        row, error = validate_batch_item(item)
+        if row is None:
+            results.append({"index": index, "event_id": None, "status": "rejected", "duplicate": False, "error": error})
+        else:
+            results.append({"index": index, "event_id": None, "status": EventStatus.queued, "duplicate": False, "error": None})
+            rows.append((index, row))
+
+    if not rows:
+        return {"accepted": 0, "duplicates": 0, "rejected": len(results), "results": results}
+
+    try:
+        # insert_events is written against a sync Session, run_sync runs it on the async session's connection without blocking the event loop
+        ingested = await db.run_sync(insert_events, [row for _, row in rows])
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    event_ids = []
+    for (index, row), event in zip(rows, ingested):
+        results[index].update(event_id=event.event_id, status=event.status, duplicate=event.duplicate)
+        if row["idempotency_key"] is not None:
+            recent_idempotency_keys.set(row["idempotency_key"], (event.event_id, event.created_at))
+        if not event.duplicate:
+            event_ids.append(event.event_id)
+
+    # one background task for the whole batch instead of one per event
+    if event_ids and settings.processing_mode == "background":
+        background_tasks.add_task(process_events_in_background, event_ids)
+
+    return {
+        "accepted": len(event_ids),
+        "duplicates": len(rows) - len(event_ids),
+        "rejected": len(results) - len(rows),
+        "results": results,
+    }
+
+
+# HTTP POST endpoint to put dead-lettered events back in the queue: POST /events/dead-letter/redrive?event_type=payment_failed&limit=1000.
+# events that ran out of retries wait in dead_letter until the cause is fixed, then this re-queues up to `limit` of them (oldest first) with their attempts reset,
+# optionally narrowed by event_type and a created_at range. call it again until "redriven" comes back 0 to re-drive everything.
+@router.post("/dead-letter/redrive")
+async def redrive_dead_lettered_events(
+    background_tasks: BackgroundTasks,
+    event_type: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    limit: int = Query(1000, ge=1, le=MAX_BATCH_SIZE),
+    db: AsyncSession = Depends(get_async_db)
+):
+    try:
+        # one UPDATE ... RETURNING moves the whole set, however many events it holds
+        event_ids = await db.run_sync(
+            redrive_dead_letters, event_type, _naive_utc(created_after), _naive_utc(created_before), limit
+        )
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    event_cache.delete_many(event_ids)
+    if event_ids and settings.processing_mode == "background":
+        background_tasks.add_task(process_events_in_background, event_ids)
+
+    return {"redriven": len(event_ids), "event_ids": event_ids}
+
+
+# HTTP GET endpoint for dashboards: GET /events/stats?granularity=minute&since=2024-05-01T12:00:00&event_type=payment_failed.
+# returns, per minute or hour of the events' created_at, how many events were processed, how many should be escalated and the counts per severity and event type.
+# it reads the pre-aggregated event_stats_rollups table instead of the results, so it costs the same with a thousand or a billion events stored.
+# it is declared before GET /{event_id}, otherwise "stats" would be taken for an event id.
+@router.get("/stats")
+async def get_event_stats(
+    granularity: str = Query("hour", pattern=f"^({'|'.join(GRANULARITIES)})$"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    event_type: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    # by default the last 60 buckets: the last hour by minute or the last 60 hours by hour
+    unit = timedelta(minutes=1) if granularity == "minute" else timedelta(hours=1)
+    # buckets are naive UTC like every timestamp in the database
+    since, until = _naive_utc(since), _naive_utc(until)
+    until = until or datetime.utcnow()
+    since = since or until - 60 * unit
+
+    if since >= until:
+        raise HTTPException(status_code=400, detail="since must be before until")
+    # the range limit keeps every request to a bounded number of rollup rows, ask for hours to look further back
+    if until - since > MAX_BUCKETS[granularity] * unit:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BUCKETS[granularity]} {granularity}s per request")
+
+    try:
+        rows = (await db.execute(stats_query(granularity, since, until, event_type))).all()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {
+        "granularity": granularity,
+        "since": since,
+        "until": until,
+        "event_type": event_type,
+        "buckets": summarize(rows),
+    }
+
+
+# HTTP GET endpoint to retrieve an event by its ID: GET /events/{event_id}, will call get_event function when this endpoint is hit.
+@router.get("/{event_id}")
+async def get_event(event_id: UUID, db: AsyncSession = Depends(get_async_db)):
+    # clients poll this endpoint while waiting for processing, so answer from the in-memory cache when we can and skip the db round trip entirely
+    cached = event_cache.get(event_id)
+    if cached is not None:
+        return cached
+
+    try:
+        event = (
+            await db.execute(select(Event).where(event_lookup(event_id)))
+        ).scalar_one_or_none()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+
+    response = _event_response(event)
+
+    # finished events rarely change again so they are kept longer, events still in flight only briefly (see app/services/cache.py)
+    finished = event.status in FINISHED_STATUSES
+    event_cache.set(event_id, response, ttl=settings.event_cache_ttl if finished else settings.event_cache_pending_ttl)
+    return response
+
+
+# HTTP GET endpoint that waits for an event to finish: GET /events/{event_id}/wait?timeout=30. Instead of polling GET /events/{event_id} in a loop,
+# the request is held open and answered the moment processing marks the event completed or failed (pushed via postgres LISTEN/NOTIFY, see app/services/notifications.py).
+# if the event is still not finished after `timeout` seconds the current state is returned, and the client can simply call again.
+@router.get("/{event_id}/wait")
+async def wait_for_event(
+    event_id: UUID,
+    timeout: float = Query(30.0, gt=0, le=settings.event_wait_max_timeout)
+):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+
+    # subscribe before the first read, so a notification arriving between the read and the wait can't be missed
+    with event_notifier.subscribe(event_id) as changed:
+        while True:
+            changed.clear()
+            response = await _fetch_event_response(event_id)
+
+            if response is None:
+                raise HTTPException(status_code=404, detail="Event not found")
+
+            remaining = deadline - loop.time()
+            if response["status"] in FINISHED_STATUSES or remaining <= 0:
+                return response
+
+            # wake up on the notification, or re-read every few seconds anyway in case one got lost (e.g. while the listener was reconnecting)
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=min(remaining, settings.event_wait_recheck_interval))
+            except asyncio.TimeoutError:
+                pass
+
+
+async def _fetch_event_response(event_id: UUID):
+    # a short-lived session per read instead of a request-wide one, so a waiting request doesn't hold a pooled connection while it sleeps
+    async with AsyncSessionLocal() as db:
+        try:
+            event = (
+                await db.execute(select(Event).where(event_lookup(event_id)))
+            ).scalar_one_or_none()
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    return _event_response(event) if event else None
+
+
+def _event_response(event: Event) -> dict:
+    return {
+        "event_id": event.event_id,
+        "event_type": event.event_type,
+        "status": event.status,
+        "payload": event.payload,
+        "error_message": event.error_message,
+        "attempts": event.attempts,
+        "next_attempt_at": event.next_attempt_at
+    }
 
 # HTTP GET endpoint to list recent events to know the process happening in app: GET /events/, will call list_events function when this endpoint is hit.
+# results are newest first and can be narrowed by status, event_type and a created_at range. Instead of OFFSET, paging uses a cursor (keyset pagination):
+# next_cursor encodes the (created_at, event_id) of the last row returned, and the next page starts right after it. postgres jumps straight to that spot in
+# the matching index, so page 1000 costs the same as page 1, while OFFSET would have to walk over every skipped row.
 @router.get("/")
-def list_events():
-    db: Session = SessionLocal()
+async def list_events(
+    status: Optional[EventStatus] = None,
+    event_type: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # only the columns we return are selected (no payload), so postgres can answer from the covering indexes on Event without touching the table
+    query = select(Event.event_id, Event.event_type, Event.status, Event.created_at)
+
+    if status is not None:
+        query = query.where(Event.status == status)
+    if event_type is not None:
+        query = query.where(Event.event_type == event_type)
+    if created_after is not None:
+        query = query.where(Event.created_at >= _naive_utc(created_after))
+    if created_before is not None:
+        query = query.where(Event.created_at < _naive_utc(created_before))
+    if cursor is not None:
+        try:
+            cursor_created_at, cursor_event_id = _decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        # row comparison: everything strictly older than the last row seen, event_id breaks ties between rows created at the same instant
+        query = query.where(tuple_(Event.created_at, Event.event_id) < tuple_(cursor_created_at, cursor_event_id))
+
+    # one extra row tells us whether there is a next page without a separate COUNT query
+    query = query.order_by(Event.created_at.desc(), Event.event_id.desc()).limit(limit + 1)
 
     try:
-        events = (
-            db.query(Event)
-            .order_by(Event.created_at.desc())
-            .limit(20)
-            .all()
-        )
+        rows = (await db.execute(query)).all()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1].created_at, rows[-1].event_id)
 
-        return [
+    return {
+        "items": [
             {
-                "event_id": event.event_id,
-                "event_type": event.event_type,
-                "status": event.status,
-                "created_at": event.created_at,
+                "event_id": row.event_id,
+                "event_type": row.event_type,
+                "status": row.status,
+                "created_at": row.created_at,
             }
-            for event in events
-        ]
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    
-    finally:
-        db.close()
\ No newline at end of file
+            for row in rows
+        ],
+        "next_cursor": next_cursor,
+    }
+
+
+# the cursor is opaque to clients: just "<created_at>|<event_id>" base64 encoded so it can travel in a query string
+def _encode_cursor(created_at: datetime, event_id: UUID) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{event_id}".encode()).decode()
+
+
+def _decode_cursor(cursor: str):
+    try:
+        created_at, event_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        # cursors we hand out hold naive UTC, a hand-made one with an offset is converted instead of failing the comparison with created_at
+        return _naive_utc(datetime.fromisoformat(created_at)), UUID(event_id)
+    except (UnicodeDecodeError, binascii.Error, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+# timestamps in the database are naive UTC, and comparing them with a timezone-aware query parameter fails in asyncpg.
+# so "...T12:00:00+02:00" is converted to a naive 10:00 (UTC) first, naive values are taken as UTC already.
+def _naive_utc(moment: Optional[datetime]) -> Optional[datetime]:
+    if moment is None or moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
@@ -0,0 +1,19 @@
+# This is for health and diagnostics endpoints, kept apart from the events endpoints as they are about the service itself rather than business data.
+from fastapi import APIRouter
+
+from app.db.session import pool_status
+from app.services.cache import event_cache
+
+router = APIRouter()
+
+# HTTP GET endpoint to inspect the db connection pools: GET /health/db. Shows pool size, connections in use, checkouts and how long callers waited for a connection,
+# which is the first thing to look at when requests stall under load.
+@router.get("/db")
+def db_pool_health():
+    return pool_status()
+
+
+# HTTP GET endpoint to inspect the event cache: GET /health/cache. Shows its size, hits, misses and evictions.
+@router.get("/cache")
+def event_cache_health():
+    return event_cache.stats()
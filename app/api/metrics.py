@@ -0,0 +1,73 @@
+# This is for the prometheus metrics endpoint: GET /metrics returns every metric of app/services/metrics.py in the prometheus text format,
+# plus the queue depth, which is counted in postgres at scrape time rather than tracked in memory, so it is right no matter which process changed the events.
+import logging
+import os
+
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import func, select
+
+from app.db.models import Event, EventStatus
+from app.db.session import engine
+
+logger = logging.getLogger("eventflo.metrics")
+
+router = APIRouter()
+
+# only in-flight statuses are counted: they are few rows found through ix_events_status_created_at, while completed/failed/dead_letter grow forever
+# and are covered by the eventflo_events_processed_total counter instead.
+IN_FLIGHT_STATUSES = (EventStatus.queued, EventStatus.processing, EventStatus.retrying)
+
+
+class QueueDepthCollector:
+    """
+    Reports how many events are in each in-flight status, queried when prometheus scrapes.
+    """
+
+    # registering a collector without describe() makes prometheus_client call collect() to learn its metric names, which would run
+    # the count query at import time, in every process importing the app (including the serve.py parent that never scrapes).
+    def describe(self):
+        yield self._gauge()
+
+    def collect(self):
+        try:
+            with engine.connect() as conn:
+                counts = dict(
+                    conn.execute(
+                        select(Event.status, func.count())
+                        .where(Event.status.in_(IN_FLIGHT_STATUSES))
+                        .group_by(Event.status)
+                    ).all()
+                )
+        except Exception:
+            # a database outage shouldn't take the other metrics down with it
+            logger.exception("Failed to count queued events")
+            return
+
+        gauge = self._gauge()
+        for status in IN_FLIGHT_STATUSES:
+            gauge.add_metric([status.value], counts.get(status, 0))
+        yield gauge
+
+    def _gauge(self):
+        return GaugeMetricFamily("eventflo_queue_depth", "Events currently queued, being processed or waiting for a retry, by status", labels=["status"])
+
+
+_queue_depth = QueueDepthCollector()
+REGISTRY.register(_queue_depth)
+
+
+# HTTP GET endpoint for prometheus to scrape: GET /metrics. it's a plain def, so the queue depth query runs in the thread pool instead of blocking the event loop.
+@router.get("/metrics", include_in_schema=False)
+def metrics():
+    # with several server processes (PROMETHEUS_MULTIPROC_DIR set), each process writes its metrics to files in that directory
+    # and every scrape merges them, so the numbers cover all processes and not just the one that happened to answer.
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_queue_depth)
+    else:
+        registry = REGISTRY
+
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
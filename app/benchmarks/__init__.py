@@ -0,0 +1,3 @@
+# BENCHMARKS: measures the hot paths of EventFlo so the cost of a change can be checked before it ships.
+# run `python -m app.benchmarks` against a scratch database (or with --pgserver for a throwaway local postgres), results are written to a JSON file,
+# and passing an earlier file with --baseline reports every metric that got worse by more than --threshold.
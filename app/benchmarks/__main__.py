@@ -0,0 +1,93 @@
+# entry point of `python -m app.benchmarks`, e.g.
+#   python -m app.benchmarks classify api --output bench/after.json --baseline bench/before.json
+import argparse
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+SUITES = ("classify", "api", "processor")
+
+
+def _int_list(value: str):
+    return [int(part) for part in value.split(",") if part]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark EventFlo's ingest, processing and read paths")
+    parser.add_argument("suites", nargs="*", metavar="suite", help=f"suites to run: {', '.join(SUITES)} (default: all)")
+    parser.add_argument("--output", default=f"benchmark-results/{datetime.utcnow():%Y%m%d-%H%M%S}.json", help="JSON file the results are written to")
+    parser.add_argument("--baseline", help="earlier results file to compare against, exits with status 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change counted as a regression (default 0.1 = 10%%)")
+    parser.add_argument("--pgserver", action="store_true", help="run against a throwaway local postgres (needs `pip install pgserver`)")
+    parser.add_argument("--iterations", type=int, default=100000, help="classify: calls per microbenchmark")
+    parser.add_argument("--classify-batch-sizes", type=_int_list, default=[100, 1000, 10000], help="classify: classify_events batch sizes")
+    parser.add_argument("--requests", type=int, default=2000, help="api: requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=32, help="api: concurrent clients")
+    parser.add_argument("--events", type=int, default=5000, help="processor: queued events per run")
+    parser.add_argument("--batch-sizes", type=_int_list, default=[1, 10, 100, 500], help="processor: events claimed per round trip")
+    parser.add_argument("--threads", type=_int_list, default=[1, 4], help="processor: worker thread counts")
+    args = parser.parse_args()
+
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suite(s): {', '.join(sorted(unknown))}")
+    suites = args.suites or SUITES
+
+    server = None
+    if args.pgserver:
+        # pgserver ships postgres binaries in a pip package, so no docker or system install is needed. it has to start before
+        # anything imports app.db.session, as the engines read EVENTFLO_DATABASE_URL at import time.
+        try:
+            import pgserver
+        except ImportError:
+            parser.error("--pgserver needs the pgserver package: pip install pgserver")
+        server = pgserver.get_server(tempfile.mkdtemp(prefix="eventflo-bench-"), cleanup_mode="delete")
+        os.environ["EVENTFLO_DATABASE_URL"] = server.get_uri()
+
+    # the api suite measures the endpoints alone: with in-process background processing every POST would also pay for
+    # classifying its event. the processor suite measures processing separately.
+    os.environ.setdefault("EVENTFLO_PROCESSING_MODE", "worker")
+
+    from app.benchmarks.common import compare, load_results, write_results
+
+    benchmarks = {}
+    if "api" in suites or "processor" in suites:
+        from app.db.init_db import init_db
+        init_db()
+
+    if "classify" in suites:
+        from app.benchmarks import classify
+        benchmarks.update(classify.run(args.iterations, args.classify_batch_sizes))
+    if "processor" in suites:
+        from app.benchmarks import processor
+        benchmarks.update(processor.run(args.events, args.batch_sizes, args.threads))
+    if "api" in suites:
+        from app.benchmarks import api
+        benchmarks.update(api.run(args.requests, args.concurrency))
+
+    write_results(args.output, benchmarks)
+
+    for name, metrics in sorted(benchmarks.items()):
+        print(name.ljust(40), "  ".join(f"{metric}={value:.6g}" for metric, value in sorted(metrics.items())))
+    print(f"\nresults written to {args.output}")
+
+    if server is not None:
+        from app.db.session import engine
+        engine.dispose()
+        server.cleanup()
+
+    if args.baseline:
+        regressions = compare(benchmarks, load_results(args.baseline), args.threshold)
+        for regression in regressions:
+            print(
+                f"REGRESSION {regression['benchmark']} {regression['metric']}: "
+                f"{regression['baseline']:.6g} -> {regression['current']:.6g} ({regression['change']:+.1%})"
+            )
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions above {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# end-to-end benchmarks of the HTTP endpoints: requests go through the whole FastAPI app (routing, validation, async session, postgres) via httpx's ASGI transport,
+# without a real socket or server process, so the numbers measure our code and the database rather than the network.
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List
+from uuid import UUID
+
+import httpx
+
+from app.benchmarks.common import delete_events, summarize_latencies
+from app.db.models import Event
+from app.db.session import SessionLocal, async_engine
+from app.main import app
+from app.services.processor import process_events
+
+SAMPLE_EVENTS = [
+    ("payment_failed", {"amount": 1500}),
+    ("payment_failed", {"amount": 200}),
+    ("sla_breach", {"minutes_over": 45}),
+    ("system_error", {"code": 500}),
+]
+
+
+async def _run_load(make_request: Callable[[int], Awaitable[httpx.Response]], total: int, concurrency: int):
+    # `concurrency` clients share one iterator of request numbers, each sends its next request as soon as the previous one is answered (a closed loop)
+    latencies: List[float] = []
+    bodies = [None] * total
+    errors = 0
+    request_numbers = iter(range(total))
+
+    async def client():
+        nonlocal errors
+        for number in request_numbers:
+            started = time.perf_counter()
+            response = await make_request(number)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+            else:
+                bodies[number] = response.json()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    summary = summarize_latencies(latencies, elapsed)
+    summary["errors"] = errors
+    return summary, bodies
+
+
+async def _run(requests: int, concurrency: int, batch_size: int):
+    results = {}
+    event_ids = []
+
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            def post_event(number):
+                event_type, payload = SAMPLE_EVENTS[number % len(SAMPLE_EVENTS)]
+                return client.post("/events/", params={"event_type": event_type}, json=payload)
+
+            results["api.post_event"], bodies = await _run_load(post_event, requests, concurrency)
+            event_ids = [UUID(body["event_id"]) for body in bodies if body is not None]
+
+            batch = [
+                {"event_type": event_type, "payload": payload, "source": "benchmark"}
+                for event_type, payload in (SAMPLE_EVENTS[number % len(SAMPLE_EVENTS)] for number in range(batch_size))
+            ]
+            batches = max(1, requests // batch_size)
+            summary, _ = await _run_load(lambda _: client.post("/events/batch", json=batch), batches, min(concurrency, batches))
+            summary["events_per_sec"] = summary["ops_per_sec"] * batch_size
+            results[f"api.post_batch_{batch_size}"] = summary
+
+            # clients mostly read events that finished processing (and those are the ones the cache keeps for long), so process them first
+            await asyncio.to_thread(_process, event_ids)
+
+            def get_event(number):
+                return client.get(f"/events/{event_ids[number]}")
+
+            # the first read of every event misses the cache and goes to postgres, the second one is answered from memory
+            results["api.get_event"], _ = await _run_load(get_event, len(event_ids), concurrency)
+            results["api.get_event_cached"], _ = await _run_load(get_event, len(event_ids), concurrency)
+
+            results["api.list_events"], _ = await _run_load(lambda _: client.get("/events/", params={"limit": 20}), requests, concurrency)
+    finally:
+        # the pooled asyncpg connections belong to this event loop, close them before asyncio.run() closes the loop
+        await async_engine.dispose()
+
+    return results, event_ids
+
+
+def _process(event_ids):
+    db = SessionLocal()
+    try:
+        process_events(event_ids, db)
+    finally:
+        db.close()
+
+
+def run(requests: int = 2000, concurrency: int = 32, batch_size: int = 100) -> Dict[str, Dict[str, float]]:
+    results, event_ids = asyncio.run(_run(requests, concurrency, batch_size))
+    delete_events(Event.event_id.in_(event_ids))
+    delete_events(Event.source == "benchmark")
+    return results
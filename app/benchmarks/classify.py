@@ -0,0 +1,57 @@
+# microbenchmarks of the rules engine: classify_event one event at a time, and classify_events for whole batches.
+# pure python, no database needed.
+import random
+import time
+from typing import Dict, List, Sequence
+
+from app.services.rules import classify_event, classify_events
+
+# one payload per rule outcome, so every threshold branch and the fallback get exercised
+SAMPLE_EVENTS = {
+    "payment_failed": [{"amount": 1500}, {"amount": 200}],
+    "sla_breach": [{"minutes_over": 45}, {"minutes_over": 5}],
+    "system_error": [{"code": 500}],
+    "unknown_type": [{}],
+}
+
+
+def _best_rate(fn, iterations: int, repeats: int) -> float:
+    # best of a few repeats: the fastest run is the one least disturbed by the rest of the machine
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn(iterations)
+        best = min(best, time.perf_counter() - started)
+    return iterations / best
+
+
+def run(iterations: int = 100000, batch_sizes: Sequence[int] = (100, 1000, 10000), repeats: int = 5) -> Dict[str, Dict[str, float]]:
+    results = {}
+
+    for event_type, payloads in SAMPLE_EVENTS.items():
+        def loop(count, event_type=event_type, payloads=payloads):
+            for index in range(count):
+                classify_event(event_type, payloads[index % len(payloads)])
+
+        ops_per_sec = _best_rate(loop, iterations, repeats)
+        results[f"classify_event.{event_type}"] = {"ops_per_sec": ops_per_sec, "mean_us": 1e6 / ops_per_sec}
+
+    # a realistic mixed batch: random types and payloads, the same for every batch size thanks to the fixed seed
+    rng = random.Random(0)
+    pool: List = [(event_type, payload) for event_type, payloads in SAMPLE_EVENTS.items() for payload in payloads]
+
+    for batch_size in batch_sizes:
+        batch = [rng.choice(pool) for _ in range(batch_size)]
+        event_types = [event_type for event_type, _ in batch]
+        payloads = [payload for _, payload in batch]
+
+        def classify_batches(count, event_types=event_types, payloads=payloads, batch_size=batch_size):
+            for _ in range(count // batch_size):
+                classify_events(event_types, payloads)
+
+        # roughly the same number of classified rows per size, so small and big batches take similar time
+        rows = max(batch_size, iterations - iterations % batch_size)
+        rows_per_sec = _best_rate(classify_batches, rows, repeats)
+        results[f"classify_events.batch_{batch_size}"] = {"rows_per_sec": rows_per_sec, "mean_us": 1e6 / rows_per_sec * batch_size}
+
+    return results
@@ -0,0 +1,128 @@
+# shared helpers of the benchmark suites: latency summaries, the JSON result file and comparing two runs.
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from typing import Any, Dict, List, Sequence
+
+from sqlalchemy import delete, select
+
+from app.config import settings
+from app.db.models import Event, EventProcessingResult
+from app.db.session import engine
+
+# metrics are compared by their name: throughput is better when higher, latencies are better when lower
+HIGHER_IS_BETTER_SUFFIXES = ("_per_sec",)
+LOWER_IS_BETTER_SUFFIXES = ("_ms", "_us")
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """
+    Returns the q-th percentile (0-100) of already sorted values, interpolating between the two closest ranks.
+    """
+
+    if not sorted_values:
+        return 0.0
+
+    rank = (len(sorted_values) - 1) * q / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (rank - lower)
+
+
+def summarize_latencies(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    """
+    Turns per-operation latencies (seconds) and the wall time of the whole run into throughput and latency percentiles.
+    """
+
+    ordered = sorted(latencies)
+    return {
+        "count": len(ordered),
+        "ops_per_sec": len(ordered) / elapsed if elapsed else 0.0,
+        "mean_ms": sum(ordered) / len(ordered) * 1000 if ordered else 0.0,
+        "p50_ms": percentile(ordered, 50) * 1000,
+        "p90_ms": percentile(ordered, 90) * 1000,
+        "p99_ms": percentile(ordered, 99) * 1000,
+        "max_ms": ordered[-1] * 1000 if ordered else 0.0,
+    }
+
+
+def run_metadata() -> Dict[str, Any]:
+    # enough context to tell whether two runs are comparable at all (same machine, same settings)
+    return {
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "git_commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "db_pool_size": settings.db_pool_size,
+            "db_max_overflow": settings.db_max_overflow,
+            "processing_mode": settings.processing_mode,
+            "event_cache_size": settings.event_cache_size,
+        },
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path: str, benchmarks: Dict[str, Dict[str, Any]]) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"meta": run_metadata(), "benchmarks": benchmarks}, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def load_results(path: str) -> Dict[str, Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["benchmarks"]
+
+
+def compare(current: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], threshold: float) -> List[Dict[str, Any]]:
+    """
+    Lists every metric present in both runs that got worse by more than `threshold` (0.1 = 10%).
+    """
+
+    regressions = []
+    for name, metrics in current.items():
+        for metric, value in metrics.items():
+            before = baseline.get(name, {}).get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(before, (int, float)) or before == 0:
+                continue
+
+            change = (value - before) / before
+            if metric.endswith(HIGHER_IS_BETTER_SUFFIXES):
+                worse = change < -threshold
+            elif metric.endswith(LOWER_IS_BETTER_SUFFIXES):
+                worse = change > threshold
+            else:
+                continue
+
+            if worse:
+                regressions.append({"benchmark": name, "metric": metric, "baseline": before, "current": value, "change": change})
+
+    return regressions
+
+
+def delete_events(condition) -> None:
+    """
+    Removes the events matching `condition` and their results, so benchmark runs don't pile up rows in the database.
+    """
+
+    # the subquery keeps this to two statements no matter how many events a run created
+    with engine.begin() as conn:
+        conn.execute(
+            delete(EventProcessingResult).where(EventProcessingResult.event_id.in_(select(Event.event_id).where(condition)))
+        )
+        conn.execute(delete(Event).where(condition))
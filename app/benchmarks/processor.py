@@ -0,0 +1,99 @@
+# processor throughput: seeds queued events, then drains them the way app/worker.py does (threads calling process_queued_events) for every
+# combination of batch size and thread count, plus the one-event-at-a-time process_event flow for comparison.
+# the workers claim every queued event in the database, so run this against a scratch database.
+import threading
+import time
+from typing import Dict, Sequence
+
+from app.benchmarks.common import delete_events
+from app.db.models import Event
+from app.db.session import SessionLocal
+from app.services.ingest import MAX_BATCH_SIZE, insert_events
+from app.services.processor import process_event, process_queued_events
+
+SAMPLE_EVENTS = [
+    ("payment_failed", {"amount": 1500}),
+    ("payment_failed", {"amount": 200}),
+    ("sla_breach", {"minutes_over": 45}),
+    ("system_error", {"code": 500}),
+]
+
+
+def _seed(count: int):
+    # events are inserted in chunks through the same code path as POST /events/batch
+    items = [
+        {"event_type": event_type, "payload": payload, "source": "benchmark"}
+        for event_type, payload in (SAMPLE_EVENTS[number % len(SAMPLE_EVENTS)] for number in range(count))
+    ]
+    event_ids = []
+    db = SessionLocal()
+    try:
+        for start in range(0, len(items), MAX_BATCH_SIZE):
+            event_ids.extend(event.event_id for event in insert_events(db, items[start:start + MAX_BATCH_SIZE]))
+            db.commit()
+    finally:
+        db.close()
+    return event_ids
+
+
+def _drain(batch_size: int, threads: int) -> int:
+    # like Worker._loop, but every thread stops as soon as there is nothing left to claim
+    processed = [0] * threads
+
+    def loop(index):
+        db = SessionLocal()
+        try:
+            while True:
+                claimed = process_queued_events(db, batch_size)
+                if not claimed:
+                    return
+                processed[index] += claimed
+        finally:
+            db.close()
+
+    pool = [threading.Thread(target=loop, args=(index,)) for index in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return sum(processed)
+
+
+def run(events: int = 5000, batch_sizes: Sequence[int] = (1, 10, 100, 500), thread_counts: Sequence[int] = (1, 4)) -> Dict[str, Dict[str, float]]:
+    results = {}
+
+    try:
+        for batch_size in batch_sizes:
+            for threads in thread_counts:
+                _seed(events)
+                started = time.perf_counter()
+                processed = _drain(batch_size, threads)
+                elapsed = time.perf_counter() - started
+
+                results[f"processor.batch_{batch_size}.threads_{threads}"] = {
+                    "events": processed,
+                    "events_per_sec": processed / elapsed,
+                    "mean_us": elapsed / processed * 1e6 if processed else 0.0,
+                }
+                delete_events(Event.source == "benchmark")
+
+        # the original single event flow, several round trips and commits per event. fewer events as it is much slower
+        event_ids = _seed(max(1, events // 10))
+        db = SessionLocal()
+        try:
+            started = time.perf_counter()
+            for event_id in event_ids:
+                process_event(event_id, db)
+            elapsed = time.perf_counter() - started
+        finally:
+            db.close()
+
+        results["processor.process_event"] = {
+            "events": len(event_ids),
+            "events_per_sec": len(event_ids) / elapsed,
+            "mean_us": elapsed / len(event_ids) * 1e6,
+        }
+    finally:
+        delete_events(Event.source == "benchmark")
+
+    return results
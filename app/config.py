@@ -0,0 +1,147 @@
+# SETTINGS: all tunable values of the app live here and are read from environment variables (prefixed with EVENTFLO_), so each deployment can change them without touching code.
+import os
+from dataclasses import dataclass
+
+
+def _env_str(name: str, default: str) -> str:
+    return os.getenv(name, default)
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# frozen=True makes settings read-only after they are loaded, so no part of the app can change them at runtime by accident.
+@dataclass(frozen=True)
+class Settings:
+    # connection string of the eventflo postgres database, the async engine uses the same database through the asyncpg driver.
+    database_url: str
+    # connections kept open in each engine's pool, and how many extra ones may be opened on top of that under bursts.
+    db_pool_size: int
+    db_max_overflow: int
+    # seconds a request waits for a free pooled connection before giving up, and after how many seconds a connection is replaced.
+    db_pool_timeout: float
+    db_pool_recycle: int
+    # test each connection with a cheap ping when it is taken from the pool, so connections dropped by the server are replaced transparently.
+    db_pool_pre_ping: bool
+    # server side limit for any single statement in milliseconds, 0 means no limit.
+    db_statement_timeout_ms: int
+    # name shown for our connections in pg_stat_activity, handy to tell api and worker connections apart.
+    db_application_name: str
+    # set when connecting through PgBouncer in transaction pooling mode: no prepared statements and no session level startup options.
+    db_pgbouncer: bool
+    # log every SQL statement, only meant for local debugging as it is slow under load.
+    db_echo: bool
+    # "background" processes events inside the API process with FastAPI BackgroundTasks (simple local setup),
+    # "worker" only stores events as queued and leaves processing to `python -m app.worker`.
+    processing_mode: str
+    # how many threads each worker process runs, and how many worker processes `python -m app.worker` starts.
+    worker_threads: int
+    worker_processes: int
+    # how many queued events one worker thread claims per round trip to the db.
+    worker_batch_size: int
+    # how long an idle worker thread sleeps before looking for queued events again, in seconds.
+    worker_poll_interval: float
+    # events stuck in processing longer than this (e.g. the worker was killed mid-way) are put back to queued, in seconds.
+    worker_stale_after: float
+    # how many attempts an event gets before it is dead-lettered, and the exponential backoff between them: the n-th retry waits
+    # between half and all of min(retry_max_delay, retry_base_delay * 2^(n-1)) seconds, the random part keeps failed batches from retrying in lockstep.
+    retry_max_attempts: int
+    retry_base_delay: float
+    retry_max_delay: float
+    # how often the scheduler moves due retries back to the queue, in seconds.
+    retry_poll_interval: float
+    # port where each worker process serves its prometheus metrics (the n-th process uses port + n), 0 turns it off.
+    worker_metrics_port: int
+    # address and port `python -m app.serve` listens on, and how many server processes it forks (0 means one per CPU core).
+    serve_host: str
+    serve_port: int
+    serve_workers: int
+    # seconds a stopping server process gets to finish in-flight requests and their background processing before it is killed.
+    serve_graceful_timeout: float
+    # log a line per request, off by default as GET /metrics already records every request and the log line costs more than the metric.
+    serve_access_log: bool
+    # how many GET /events/{event_id} responses are cached in memory per process, 0 turns the cache off.
+    event_cache_size: int
+    # seconds a cached event stays valid once it reached completed/failed, and while it is still queued/processing.
+    event_cache_ttl: float
+    event_cache_pending_ttl: float
+    # how many recently seen idempotency keys each process remembers, and for how many seconds, so retried submissions are answered without a db write.
+    idempotency_cache_size: int
+    idempotency_cache_ttl: float
+    # LISTEN needs a real postgres session, so behind PgBouncer in transaction mode point this at postgres directly (empty means database_url).
+    notify_database_url: str
+    # longest a GET /events/{event_id}/wait request may hold on, and how often it re-reads the event in case a notification was missed, in seconds.
+    event_wait_max_timeout: float
+    event_wait_recheck_interval: float
+    # how many months of partitions ahead of the current one `python -m app.db.partitions` keeps created,
+    # how many months of data it keeps (0 keeps everything), and where it archives retired months before dropping them (empty drops without archiving).
+    partition_months_ahead: int
+    partition_retention_months: int
+    partition_archive_dir: str
+    # days of per-minute dashboard rollups the same command keeps (0 keeps everything), hourly ones are kept as long as the partitions.
+    rollup_minute_retention_days: int
+    # create a GIN index on events.payload so containment queries (payload @> '{"currency": "EUR"}') don't scan whole partitions.
+    # off by default as every ingested event then also updates the index.
+    payload_gin_index: bool
+    # JSON file holding the classification rules, see app/services/rules.json for the format.
+    rules_path: str
+
+
+def load_settings() -> Settings:
+    return Settings(
+        database_url=_env_str("EVENTFLO_DATABASE_URL", "postgresql://localhost/eventflo"),
+        db_pool_size=_env_int("EVENTFLO_DB_POOL_SIZE", 10),
+        db_max_overflow=_env_int("EVENTFLO_DB_MAX_OVERFLOW", 20),
+        db_pool_timeout=_env_float("EVENTFLO_DB_POOL_TIMEOUT", 30.0),
+        db_pool_recycle=_env_int("EVENTFLO_DB_POOL_RECYCLE", 1800),
+        db_pool_pre_ping=_env_bool("EVENTFLO_DB_POOL_PRE_PING", True),
+        db_statement_timeout_ms=_env_int("EVENTFLO_DB_STATEMENT_TIMEOUT_MS", 0),
+        db_application_name=_env_str("EVENTFLO_DB_APPLICATION_NAME", "eventflo"),
+        db_pgbouncer=_env_bool("EVENTFLO_DB_PGBOUNCER", False),
+        db_echo=_env_bool("EVENTFLO_DB_ECHO", False),
+        processing_mode=_env_str("EVENTFLO_PROCESSING_MODE", "background"),
+        worker_threads=_env_int("EVENTFLO_WORKER_THREADS", 4),
+        worker_processes=_env_int("EVENTFLO_WORKER_PROCESSES", 1),
+        worker_batch_size=_env_int("EVENTFLO_WORKER_BATCH_SIZE", 100),
+        worker_poll_interval=_env_float("EVENTFLO_WORKER_POLL_INTERVAL", 1.0),
+        worker_stale_after=_env_float("EVENTFLO_WORKER_STALE_AFTER", 300.0),
+        retry_max_attempts=_env_int("EVENTFLO_RETRY_MAX_ATTEMPTS", 5),
+        retry_base_delay=_env_float("EVENTFLO_RETRY_BASE_DELAY", 2.0),
+        retry_max_delay=_env_float("EVENTFLO_RETRY_MAX_DELAY", 600.0),
+        retry_poll_interval=_env_float("EVENTFLO_RETRY_POLL_INTERVAL", 1.0),
+        worker_metrics_port=_env_int("EVENTFLO_WORKER_METRICS_PORT", 0),
+        serve_host=_env_str("EVENTFLO_SERVE_HOST", "0.0.0.0"),
+        serve_port=_env_int("EVENTFLO_SERVE_PORT", 8000),
+        serve_workers=_env_int("EVENTFLO_SERVE_WORKERS", 0),
+        serve_graceful_timeout=_env_float("EVENTFLO_SERVE_GRACEFUL_TIMEOUT", 30.0),
+        serve_access_log=_env_bool("EVENTFLO_SERVE_ACCESS_LOG", False),
+        event_cache_size=_env_int("EVENTFLO_EVENT_CACHE_SIZE", 10000),
+        event_cache_ttl=_env_float("EVENTFLO_EVENT_CACHE_TTL", 60.0),
+        event_cache_pending_ttl=_env_float("EVENTFLO_EVENT_CACHE_PENDING_TTL", 1.0),
+        idempotency_cache_size=_env_int("EVENTFLO_IDEMPOTENCY_CACHE_SIZE", 100000),
+        idempotency_cache_ttl=_env_float("EVENTFLO_IDEMPOTENCY_CACHE_TTL", 3600.0),
+        notify_database_url=_env_str("EVENTFLO_NOTIFY_DATABASE_URL", ""),
+        event_wait_max_timeout=_env_float("EVENTFLO_EVENT_WAIT_MAX_TIMEOUT", 60.0),
+        event_wait_recheck_interval=_env_float("EVENTFLO_EVENT_WAIT_RECHECK_INTERVAL", 5.0),
+        partition_months_ahead=_env_int("EVENTFLO_PARTITION_MONTHS_AHEAD", 3),
+        partition_retention_months=_env_int("EVENTFLO_PARTITION_RETENTION_MONTHS", 0),
+        partition_archive_dir=_env_str("EVENTFLO_PARTITION_ARCHIVE_DIR", ""),
+        rollup_minute_retention_days=_env_int("EVENTFLO_ROLLUP_MINUTE_RETENTION_DAYS", 7),
+        payload_gin_index=_env_bool("EVENTFLO_PAYLOAD_GIN_INDEX", False),
+        rules_path=_env_str("EVENTFLO_RULES_PATH", os.path.join(os.path.dirname(__file__), "services", "rules.json")),
+    )
+
+
+settings = load_settings()
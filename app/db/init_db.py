@@ -1,11 +1,33 @@
+from sqlalchemy import text
+
 from app.db.session import engine
 # although base is defined in sessions but all the tables are defined in models so we need to import base from models to have access to all the models defined there. once we import base form sesisons you have no models there so base has zero tbales registered, if its imported from models sqlalchemy makes usre that all models defined in that file are registered under base.
 from app.db.models import Base
+from app.db.migrate import table_kind
+from app.db.partitions import ensure_partitions
+from app.config import settings
 
 # metadata is all the information associated with the tables like their structure, relationships, columns, etc. create all creates all real SQL tables in database.
+# events and event_processing_results are partitioned tables, which can't hold rows themselves, so the monthly partitions are created right after them.
 def init_db():
+    # create_all skips tables that already exist, so a database from before partitioning would keep its plain tables and ensure_partitions
+    # below would fail with '"events" is not partitioned'. those are converted by their own command, which copies the rows over in batches.
+    with engine.connect() as conn:
+        if table_kind(conn, "events") == "plain":
+            raise RuntimeError(
+                "The events table was created before partitioning, convert it with `python -m app.db.migrate` first (see README.md)"
+            )
+
     Base.metadata.create_all(bind=engine)
 
+    with engine.begin() as conn:
+        ensure_partitions(conn, settings.partition_months_ahead)
+
+        # optional, not part of the model so create_all doesn't always build it. created on the partitioned table, postgres adds it to every
+        # partition, including the ones created later. jsonb_path_ops makes a smaller and faster index that only supports @> containment queries.
+        if settings.payload_gin_index:
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_events_payload_gin ON events USING gin (payload jsonb_path_ops)"))
+
 # TThis makes sure only when this file is executed the init_db runs not every time it just gets imported somewhere else.
 if __name__ == "__main__":
     init_db()
\ No newline at end of file
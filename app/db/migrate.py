@@ -0,0 +1,224 @@
+# MIGRATE: upgrades a database whose events and event_processing_results tables were created before they were partitioned, run it once with
+# `python -m app.db.migrate`. create_all can't turn an existing plain table into a partitioned one, so this moves the old tables aside (events becomes
+# events_unpartitioned, its indexes are renamed the same way), creates the partitioned tables with a partition for every month the old rows cover,
+# and copies the rows over month by month in batches of --batch-size events, each batch with its results in its own short transaction.
+# the API and workers can keep running: new events go straight to the partitioned tables and older ones show up as soon as their month is copied.
+# an interrupted run is simply started again, rows that were already copied are skipped. the old tables are kept until you drop them once checked.
+# it then adds the columns later versions added to the events table (see UPGRADE_STATEMENTS), as create_all never adds columns to an existing table.
+# every step checks what is already there first, so running it on an up to date database changes nothing.
+import argparse
+import logging
+from datetime import date, datetime
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from app.config import settings
+from app.db.models import Base, Event, EventProcessingResult, EventStatus
+from app.db.partitions import ensure_partitions
+
+logger = logging.getLogger("eventflo.migrate")
+
+# suffix of the old plain tables (and their indexes) once moved aside
+OLD_SUFFIX = "_unpartitioned"
+
+# schema changes made to the events table after it became partitioned, oldest first. ADD COLUMN on the partitioned table adds the column to
+# every partition, and without a default (or with a constant one) postgres only changes the catalog instead of rewriting the rows.
+UPGRADE_STATEMENTS = [
+    # idempotent ingestion: the key the producer sent, the unique keys themselves live in the event_idempotency_keys table created by init_db
+    "ALTER TABLE events ADD COLUMN IF NOT EXISTS idempotency_key varchar(255)",
+    # retries: the failed attempts and when the next one is due, plus the partial index the retry scheduler scans (the statuses are added by add_enum_values)
+    "ALTER TABLE events ADD COLUMN IF NOT EXISTS attempts integer NOT NULL DEFAULT 0",
+    "ALTER TABLE events ADD COLUMN IF NOT EXISTS next_attempt_at timestamp",
+    "CREATE INDEX IF NOT EXISTS ix_events_retry_due ON events (next_attempt_at) WHERE status = 'retrying'",
+    # compact payloads: JSONB instead of JSON (this one rewrites every partition under a lock, and only runs while the column is still json)
+    # and the hot value copied out at ingest. events stored before keep hot_field NULL and are classified from their payload.
+    "DO $$ BEGIN "
+    "IF (SELECT data_type FROM information_schema.columns "
+    "WHERE table_schema = current_schema() AND table_name = 'events' AND column_name = 'payload') = 'json' THEN "
+    "ALTER TABLE events ALTER COLUMN payload TYPE jsonb USING payload::jsonb; "
+    "END IF; END $$",
+    "ALTER TABLE events ADD COLUMN IF NOT EXISTS hot_field varchar, ADD COLUMN IF NOT EXISTS hot_value double precision",
+]
+
+
+def table_kind(conn: Connection, table: str) -> Optional[str]:
+    """
+    Returns "plain" or "partitioned" for an existing table, None when there is no such table.
+    """
+
+    relkind = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table}).scalar()
+    return {"r": "plain", "p": "partitioned"}.get(relkind)
+
+
+def add_enum_values(conn: Connection) -> None:
+    """
+    Adds statuses introduced after the eventstatus type was created, if it already exists.
+    """
+
+    if conn.execute(text("SELECT to_regtype('eventstatus')")).scalar() is None:
+        return
+    for status in EventStatus:
+        conn.execute(text(f"ALTER TYPE eventstatus ADD VALUE IF NOT EXISTS '{status.value}'"))
+
+
+def _columns(conn: Connection, table: str) -> List[str]:
+    rows = conn.execute(text(
+        "SELECT column_name FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = :table"
+    ), {"table": table})
+    return [row[0] for row in rows]
+
+
+def _move_aside(conn: Connection, table: str) -> None:
+    # the partitioned tables get the same index names (events_pkey, ix_events_created_at, ...), so the old table's indexes are renamed along with it
+    indexes = [row[0] for row in conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = :table"), {"table": table})]
+    conn.execute(text(f"ALTER TABLE {table} RENAME TO {table}{OLD_SUFFIX}"))
+    for index in indexes:
+        conn.execute(text(f"ALTER INDEX {index} RENAME TO {index}{OLD_SUFFIX}"))
+
+
+def _month_index(day: date) -> int:
+    return day.year * 12 + day.month - 1
+
+
+def convert_to_partitioned(engine: Engine, batch_size: int, months_ahead: int) -> None:
+    """
+    Replaces plain events and event_processing_results tables with partitioned ones and copies their rows over in batches.
+    """
+
+    old_events = f"events{OLD_SUFFIX}"
+    old_results = f"event_processing_results{OLD_SUFFIX}"
+
+    # the partitioned tables are created from the current models, whose indexes use every status. older databases lack the newer values, and
+    # postgres only lets a transaction use values added to an enum after they are committed, so they get a transaction of their own.
+    with engine.begin() as conn:
+        add_enum_values(conn)
+
+    # 1. swap: the old tables are renamed and the partitioned ones created under the real names with the current months' partitions.
+    # it's one short transaction, so the app never finds the tables missing and only waits for it to commit.
+    with engine.begin() as conn:
+        if table_kind(conn, "events") == "plain":
+            _move_aside(conn, "events")
+            if table_kind(conn, "event_processing_results") == "plain":
+                _move_aside(conn, "event_processing_results")
+            Base.metadata.create_all(bind=conn, tables=[Event.__table__, EventProcessingResult.__table__])
+            ensure_partitions(conn, months_ahead)
+            logger.info("Moved the plain tables aside as %s and %s", old_events, old_results)
+
+        if table_kind(conn, old_events) is None:
+            logger.info("events is partitioned and there is nothing left to copy")
+            return
+
+    with engine.begin() as conn:
+        # created_at used to be nullable, but the partition key can't be. such rows take their updated_at, or the time of the upgrade
+        conn.execute(text(
+            f"UPDATE {old_events} SET created_at = COALESCE(updated_at, timezone('utc', now())) WHERE created_at IS NULL"
+        ))
+        first, last = conn.execute(text(f"SELECT min(created_at), max(created_at) FROM {old_events}")).one()
+        months = []
+        if first is not None:
+            # a partition for every month holding old rows, so none of them lands in the default partition
+            ensure_partitions(conn, max(_month_index(datetime.utcnow().date()) - _month_index(first.date()), 0), today=first.date())
+            months = [date(index // 12, index % 12 + 1, 1) for index in range(_month_index(first), _month_index(last) + 1)]
+
+    # the batches below walk the old table in (created_at, event_id) order, this index lets each one start where the previous stopped.
+    # databases from before the GET /events indexes don't have one yet.
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {old_events}_created_at_event_id ON {old_events} (created_at, event_id)"))
+
+    # 2. copy, only the columns both versions of a table have. columns added since get their defaults
+    with engine.connect() as conn:
+        event_columns = [c for c in Event.__table__.columns.keys() if c in _columns(conn, old_events)]
+        result_columns = [
+            c for c in EventProcessingResult.__table__.columns.keys()
+            if c != "event_created_at" and c in _columns(conn, old_results)
+        ]
+
+    copied_events = copied_results = 0
+    for month in months:
+        end = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+        after = None
+        while True:
+            with engine.begin() as conn:
+                after, events, results = _copy_batch(conn, old_events, old_results, event_columns, result_columns, month, end, after, batch_size)
+            copied_events += events
+            copied_results += results
+            if after is None:
+                break
+        logger.info("Copied %s, %s events and %s results so far", f"{month:%Y-%m}", copied_events, copied_results)
+
+    logger.info(
+        "All rows are copied. Once checked, drop the old tables: DROP TABLE %s; DROP TABLE %s;",
+        old_results, old_events,
+    )
+
+
+def upgrade_columns(conn: Connection) -> None:
+    """
+    Runs UPGRADE_STATEMENTS on an existing events table.
+    """
+
+    if table_kind(conn, "events") is None:
+        return
+    for statement in UPGRADE_STATEMENTS:
+        conn.execute(text(statement))
+
+
+def _copy_batch(conn, old_events, old_results, event_columns, result_columns, start, end, after, batch_size):
+    # keyset pagination over the old table: the next batch_size events of the month after the last copied (created_at, event_id).
+    # the CTE hands back the key of the batch's last row, which is where the next batch starts. ON CONFLICT skips rows a previous run copied.
+    bounds = {"start": start, "end": end, "limit": batch_size}
+    after_condition = result_after_condition = ""
+    if after is not None:
+        after_condition = "AND (created_at, event_id) > (:after_created_at, :after_event_id)"
+        result_after_condition = "AND (e.created_at, e.event_id) > (:after_created_at, :after_event_id)"
+        bounds.update(after_created_at=after[0], after_event_id=after[1])
+
+    columns = ", ".join(event_columns)
+    last = conn.execute(text(
+        f"WITH batch AS ("
+        f"SELECT {columns} FROM {old_events} WHERE created_at >= :start AND created_at < :end {after_condition} "
+        f"ORDER BY created_at, event_id LIMIT :limit), "
+        f"copied AS (INSERT INTO events ({columns}) SELECT {columns} FROM batch ON CONFLICT DO NOTHING RETURNING 1) "
+        f"SELECT created_at, event_id, (SELECT count(*) FROM batch), (SELECT count(*) FROM copied) "
+        f"FROM batch ORDER BY created_at DESC, event_id DESC LIMIT 1"
+    ), bounds).first()
+    if last is None:
+        return None, 0, 0
+
+    # the results of exactly those events. the old results table has no event_created_at, it is taken from the event they belong to
+    results = 0
+    if table_kind(conn, old_results) is not None:
+        bounds.update(last_created_at=last[0], last_event_id=last[1])
+        columns = ", ".join(result_columns)
+        results = conn.execute(text(
+            f"INSERT INTO event_processing_results ({columns}, event_created_at) "
+            f"SELECT {', '.join('r.' + c for c in result_columns)}, e.created_at "
+            f"FROM {old_events} e JOIN {old_results} r ON r.event_id = e.event_id "
+            f"WHERE e.created_at >= :start AND e.created_at < :end {result_after_condition} "
+            f"AND (e.created_at, e.event_id) <= (:last_created_at, :last_event_id) "
+            f"ON CONFLICT DO NOTHING"
+        ), bounds).rowcount
+
+    after = (last[0], last[1]) if last[2] == batch_size else None
+    return after, last[3], results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upgrade an existing EventFlo database: partition plain tables and add new columns")
+    parser.add_argument("--batch-size", type=int, default=10000, help="events copied per transaction")
+    parser.add_argument("--months-ahead", type=int, default=settings.partition_months_ahead)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    from app.db.session import engine
+    convert_to_partitioned(engine, args.batch_size, args.months_ahead)
+    with engine.begin() as conn:
+        upgrade_columns(conn)
+    logger.info("Columns up to date, run init_db to create any tables added since")
+
+
+if __name__ == "__main__":
+    main()
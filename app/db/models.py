@@ -7,16 +7,21 @@ import uuid
 from datetime import datetime
 
 from sqlalchemy import (
+    BigInteger,
     Column,
     String,
     DateTime,
     Enum,
-    JSON,
+    Float,
     Text,
     Boolean,
-    ForeignKey
+    ForeignKeyConstraint,
+    Index,
+    Integer,
+    SmallInteger,
+    text
 )
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import JSONB, UUID
 from sqlalchemy.orm import relationship
 
 # all models will be inheriting from this Base class to define themselves as tables in db
@@ -28,6 +33,10 @@ class EventStatus(str, enum.Enum):
     processing = "processing"
     completed = "completed"
     failed = "failed"
+    # processing hit a transient error (db error, lock timeout, crashed worker) and will be tried again at next_attempt_at
+    retrying = "retrying"
+    # gave up after too many attempts, only POST /events/dead-letter/redrive puts it back in the queue
+    dead_letter = "dead_letter"
 
 
 class SeverityLevel(str, enum.Enum):
@@ -39,15 +48,43 @@ class SeverityLevel(str, enum.Enum):
 # EVENT data model representing the events table in the database
 class Event(Base):
     __tablename__ = "events"
+    # indexes that back GET /events: newest first overall, or filtered by status / event_type. event_id is the tie breaker used by the pagination cursor,
+    # and INCLUDE stores the other listed columns in the index itself (a covering index), so postgres answers the listing from the index alone without visiting the table.
+    # (status, created_at) also serves the workers, which claim the oldest queued events.
+    __table_args__ = (
+        Index("ix_events_created_at", "created_at", "event_id", postgresql_include=["event_type", "status"]),
+        Index("ix_events_status_created_at", "status", "created_at", "event_id", postgresql_include=["event_type"]),
+        Index("ix_events_event_type_created_at", "event_type", "created_at", "event_id", postgresql_include=["status"]),
+        # partial index holding only the events waiting for a retry, ordered by when they are due. the retry scheduler finds every due event
+        # with one range scan of it, and it stays tiny because events leave it as soon as they are retried.
+        Index("ix_events_retry_due", "next_attempt_at", postgresql_where=text("status = 'retrying'")),
+        # the table is range partitioned by created_at: postgres stores each month in its own child table (events_p202601, ...), created by app/db/partitions.py.
+        # queries bounded by created_at only read the matching months, and old months are dropped or archived whole instead of DELETEd row by row.
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
     # uuid.uuid4() generates a random UUID and UUID(as_uuid=True) ensures that the UUID is stored in the database in its native binary format rather than as a string.
+    # on a partitioned table every primary key has to contain the partition column, so the key is (event_id, created_at). event_id alone is still unique in practice.
+    # the API and ingest set a UUIDv7 generated from created_at instead (app/services/event_ids.py), so lookups by id only read the event's own month. uuid4 is the fallback default.
     event_id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     event_type = Column(String, nullable=False)
     source = Column(String, nullable=True)
     # Enum(EventStatus) → only allowed enum values defined in EventStatus can be stored in this column. Default is 'queued' when a new event is created.
     status = Column(Enum(EventStatus), nullable=False, default=EventStatus.queued)
-    payload = Column(JSON, nullable=False)
+    # JSONB stores the payload parsed into postgres' binary format, so it isn't re-parsed from text on every read and can be GIN indexed
+    # (see EVENTFLO_PAYLOAD_GIN_INDEX in app/db/init_db.py). the price is that key order and duplicate keys of the original JSON are not kept.
+    payload = Column(JSONB, nullable=False)
+    # the one payload value the event type's rule compares (e.g. amount for payment_failed), copied out at ingest so processing can classify the event
+    # without reading and deserializing the whole payload. hot_field is the key it was taken from ("" when the rule reads nothing) and hot_value its number,
+    # NULL when the key was missing. both are NULL when the value isn't a plain number, then processing reads the payload. see extract_hot_field in app/services/rules.py.
+    hot_field = Column(String, nullable=True)
+    hot_value = Column(Float, nullable=True)
     error_message = Column(Text, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    # how many processing attempts failed with a transient error so far, and when the next one is due (only set while status is retrying)
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    next_attempt_at = Column(DateTime, nullable=True)
+    # key the producer sent with the event (Idempotency-Key header or batch field), kept for tracing. uniqueness is enforced by EventIdempotencyKey below.
+    idempotency_key = Column(String(255), nullable=True)
+    created_at = Column(DateTime, primary_key=True, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # relationship: which is related to ORM, when loading an Event, it provides an easy access to its related data.
@@ -62,16 +99,51 @@ class Event(Base):
 # EVENT PROCESSING RESULT data model representing the event_processing_results table in the database
 class EventProcessingResult(Base):
     __tablename__ = "event_processing_results"
-
-    event_id = Column(
-        UUID(as_uuid=True),
-        ForeignKey("events.event_id"),
-        primary_key=True
+    # results are partitioned on the same months as their events (by the event's created_at), so a month of events and its results are archived or dropped together.
+    # the foreign key has to point at the full (event_id, created_at) key of the partitioned events table.
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ["event_id", "event_created_at"],
+            ["events.event_id", "events.created_at"]
+        ),
+        {"postgresql_partition_by": "RANGE (event_created_at)"},
     )
+
+    event_id = Column(UUID(as_uuid=True), primary_key=True)
+    # copy of the event's created_at, needed for the foreign key and to place the result in the right partition.
+    event_created_at = Column(DateTime, primary_key=True)
     severity = Column(Enum(SeverityLevel), nullable=False)
     classification_reason = Column(Text, nullable=False)
     recommendation = Column(Text, nullable=False)
     should_escalate = Column(Boolean, nullable=False)
     processed_at = Column(DateTime, default=datetime.utcnow)
-    # each EventProcessingResult is linked back to its corresponding Event using the foreign key event_id.
-    event = relationship("Event", back_populates="processing_result")
\ No newline at end of file
+    # each EventProcessingResult is linked back to its corresponding Event using the foreign key (event_id, event_created_at).
+    event = relationship("Event", back_populates="processing_result")
+
+# EVENT IDEMPOTENCY KEY data model representing the event_idempotency_keys table: one row per idempotency key a producer ever sent, pointing at the event it created.
+# a unique index on events.idempotency_key isn't possible because unique indexes on a partitioned table must include created_at, so this small plain table holds
+# the unique key instead. ingestion inserts the key first with ON CONFLICT DO NOTHING, and only creates the event when that insert actually added the row.
+class EventIdempotencyKey(Base):
+    __tablename__ = "event_idempotency_keys"
+
+    idempotency_key = Column(String(255), primary_key=True)
+    event_id = Column(UUID(as_uuid=True), nullable=False)
+    event_created_at = Column(DateTime, nullable=False)
+
+# EVENT STATS ROLLUP data model representing the event_stats_rollups table: how many events of each type got each severity/escalation outcome,
+# counted per minute and per hour of the events' created_at. processing adds to these counts in the same transaction that stores the results,
+# so GET /events/stats reads a few hundred small rows instead of counting millions of results, however many events the tables hold.
+class EventStatsRollup(Base):
+    __tablename__ = "event_stats_rollups"
+
+    # "minute" or "hour", both are kept so long ranges are read from the hourly rows without summing up 60 minute rows each
+    granularity = Column(String(6), primary_key=True)
+    # start of the minute/hour the counted events were created in
+    bucket = Column(DateTime, primary_key=True)
+    event_type = Column(String, primary_key=True)
+    severity = Column(Enum(SeverityLevel), primary_key=True)
+    should_escalate = Column(Boolean, primary_key=True)
+    # every bucket's count is split over a few rows, one per shard, and readers add them up. a transaction locks the rows it adds to until it commits,
+    # with a single row per bucket every worker would queue behind the others on the current minute, each picking a random shard lets them add in parallel.
+    shard = Column(SmallInteger, primary_key=True, default=0)
+    count = Column(BigInteger, nullable=False, default=0)
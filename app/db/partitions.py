@@ -0,0 +1,255 @@
+# PARTITIONS: creates and retires the monthly partitions of the events and event_processing_results tables.
+# run it regularly (e.g. daily from cron) with `python -m app.db.partitions`: it creates the partitions for the coming months ahead of time,
+# and detaches every month older than the retention period, optionally archiving its rows to gzipped JSONL files before dropping it.
+# it also deletes expired rows of the event_stats_rollups table, which isn't partitioned but would otherwise grow by a few thousand rows every hour.
+import argparse
+import gzip
+import logging
+import os
+import re
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from app.config import settings
+
+logger = logging.getLogger("eventflo.partitions")
+
+# (parent table, prefix of its monthly partitions, partition key column), results after events as they reference them through a foreign key
+PARTITIONED_TABLES = [
+    ("events", "events", "created_at"),
+    ("event_processing_results", "event_processing_results", "event_created_at"),
+]
+
+_PARTITION_NAME = re.compile(r"_p(\d{4})(\d{2})$")
+
+
+def _add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _first_of_month(day: date) -> date:
+    return date(day.year, day.month, 1)
+
+
+def ensure_partitions(conn: Connection, months_ahead: int, today: Optional[date] = None) -> None:
+    """
+    Creates the default partitions plus one partition per month from the current month to `months_ahead` months ahead.
+    """
+
+    current = _first_of_month(today or datetime.utcnow().date())
+
+    for parent, prefix, _ in PARTITIONED_TABLES:
+        # rows outside every monthly range (e.g. maintenance didn't run for a while) land in the default partition instead of failing the insert
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {prefix}_default PARTITION OF {parent} DEFAULT"))
+
+    for offset in range(months_ahead + 1):
+        start = _add_months(current, offset)
+        missing = [
+            (parent, prefix) for parent, prefix, _ in PARTITIONED_TABLES
+            if conn.execute(text("SELECT to_regclass(:name)"), {"name": f"{prefix}_p{start:%Y%m}"}).scalar() is None
+        ]
+        if missing:
+            _create_month(conn, start, missing)
+
+
+def _create_month(conn: Connection, start: date, missing: List[Tuple[str, str]]) -> None:
+    end = _add_months(start, 1)
+    bounds = {"start": start, "end": end}
+
+    # postgres refuses to create a month's partition while the default partition holds rows of that month, and then every later run would fail.
+    # so the month's rows are first moved out of the defaults into temporary tables (results before the events they reference), the partitions
+    # are created, and the rows are inserted again through the parents, which routes them into the new partitions. it's all one transaction,
+    # so the rows are never missing for anyone else.
+    moved = {}
+    for parent, prefix, key in reversed(PARTITIONED_TABLES):
+        stash = f"{prefix}_moving"
+        conn.execute(text(f"CREATE TEMPORARY TABLE {stash} (LIKE {parent}) ON COMMIT DROP"))
+        moved[parent] = conn.execute(text(
+            f"WITH moved AS (DELETE FROM {prefix}_default WHERE {key} >= :start AND {key} < :end RETURNING *) "
+            f"INSERT INTO {stash} SELECT * FROM moved"
+        ), bounds).rowcount
+
+    for parent, prefix in missing:
+        conn.execute(text(
+            f"CREATE TABLE {prefix}_p{start:%Y%m} PARTITION OF {parent} "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        ))
+
+    for parent, prefix, _ in PARTITIONED_TABLES:
+        if moved[parent]:
+            conn.execute(text(f"INSERT INTO {parent} SELECT * FROM {prefix}_moving"))
+            logger.warning("Moved %s rows of %s from %s_default into %s_p%s", moved[parent], start, prefix, prefix, f"{start:%Y%m}")
+        conn.execute(text(f"DROP TABLE {prefix}_moving"))
+
+
+def list_partitions(conn: Connection, parent: str) -> List[str]:
+    rows = conn.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :parent ORDER BY child.relname"
+    ), {"parent": parent})
+    return [row[0] for row in rows]
+
+
+def list_detached_partitions(conn: Connection, prefix: str) -> List[str]:
+    # monthly tables that are no longer attached to their parent, i.e. detached by an earlier run that didn't get to drop them
+    rows = conn.execute(text(
+        "SELECT relname FROM pg_class WHERE relkind = 'r' AND NOT relispartition AND relname ~ :pattern ORDER BY relname"
+    ), {"pattern": f"^{prefix}_p[0-9]{{6}}$"})
+    return [row[0] for row in rows]
+
+
+def _partition_month(name: str) -> Optional[date]:
+    match = _PARTITION_NAME.search(name)
+    if not match:
+        return None
+    return date(int(match.group(1)), int(match.group(2)), 1)
+
+
+def _archive_table(conn: Connection, table: str, archive_dir: str) -> str:
+    # rows are streamed through a server side cursor, so even a huge month never has to fit in memory
+    path = os.path.join(archive_dir, f"{table}.jsonl.gz")
+    result = conn.execution_options(stream_results=True, yield_per=10000).execute(
+        text(f"SELECT row_to_json(t)::text FROM {table} AS t")
+    )
+    _write_jsonl(path, result)
+    return path
+
+
+def _write_jsonl(path: str, rows) -> None:
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for (line,) in rows:
+            f.write(line)
+            f.write("\n")
+
+
+def _retire_default_rows(engine: Engine, prefix: str, key: str, cutoff: date, archive_dir: Optional[str]) -> int:
+    # rows that landed in the default partition are retired row by row, as the table itself also holds rows that must be kept.
+    # DELETE ... RETURNING hands back exactly the rows it removed, and the transaction only commits once they are written to the archive.
+    # the returned rows are held in memory, which is fine as the default partition only catches stray rows.
+    with engine.begin() as conn:
+        rows = conn.execute(
+            text(f"DELETE FROM {prefix}_default AS t WHERE {key} < :cutoff RETURNING row_to_json(t)::text"), {"cutoff": cutoff}
+        ).all()
+        if rows and archive_dir:
+            os.makedirs(archive_dir, exist_ok=True)
+            # named after the run, as later runs can find more old rows and must not overwrite this archive
+            path = os.path.join(archive_dir, f"{prefix}_default_{datetime.utcnow():%Y%m%d%H%M%S}.jsonl.gz")
+            _write_jsonl(path, rows)
+            logger.info("Archived %s rows of %s_default to %s", len(rows), prefix, path)
+    return len(rows)
+
+
+def retire_partitions(engine: Engine, retention_months: int, archive_dir: Optional[str], today: Optional[date] = None) -> List[str]:
+    """
+    Detaches every monthly partition older than `retention_months`, archives it when `archive_dir` is set, and drops it.
+    """
+
+    cutoff = _add_months(_first_of_month(today or datetime.utcnow().date()), -retention_months)
+    retired = []
+
+    # idempotency keys of the retired months go first, so no key is ever left pointing at an event that no longer exists
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM event_idempotency_keys WHERE event_created_at < :cutoff"), {"cutoff": cutoff})
+
+    # results reference events through a foreign key, so their partitions have to go first
+    for parent, prefix, key in reversed(PARTITIONED_TABLES):
+        if _retire_default_rows(engine, prefix, key, cutoff, archive_dir):
+            retired.append(f"{prefix}_default (rows before {cutoff})")
+
+        # DETACH briefly locks the parent table, so it gets its own short transaction. once detached the partition is a plain table
+        # the parent no longer sees, and the (slow) archiving below doesn't block inserts or queries on the live table.
+        with engine.begin() as conn:
+            for name in list_partitions(conn, parent):
+                month = _partition_month(name)
+                if month is not None and month < cutoff:
+                    conn.execute(text(f"ALTER TABLE {parent} DETACH PARTITION {name}"))
+
+        # this also picks up tables a previous run detached but failed to archive, so nothing is ever dropped without its archive
+        with engine.connect() as conn:
+            detached = [name for name in list_detached_partitions(conn, prefix) if _partition_month(name) < cutoff]
+
+        for name in detached:
+            if archive_dir:
+                os.makedirs(archive_dir, exist_ok=True)
+                with engine.connect() as conn:
+                    path = _archive_table(conn, name, archive_dir)
+                logger.info("Archived %s to %s", name, path)
+
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP TABLE {name}"))
+            retired.append(name)
+
+    return retired
+
+
+def prune_rollups(
+    conn: Connection, minute_retention_days: int, retention_months: int, now: Optional[datetime] = None
+) -> Tuple[int, int]:
+    """
+    Deletes minute rollups older than `minute_retention_days` and hour rollups of retired months, a retention of 0 keeps them.
+
+    Returns the number of minute and hour rows deleted.
+    """
+
+    now = now or datetime.utcnow()
+    deleted = []
+    # minute rows are only read for the last day at most (MAX_BUCKETS in app/services/rollups.py), the hour rows cover the months the events are kept for.
+    # both deletes are range scans of the primary key, which starts with (granularity, bucket).
+    for granularity, cutoff in (
+        ("minute", now - timedelta(days=minute_retention_days) if minute_retention_days > 0 else None),
+        ("hour", _add_months(_first_of_month(now.date()), -retention_months) if retention_months > 0 else None),
+    ):
+        if cutoff is None:
+            deleted.append(0)
+            continue
+        deleted.append(conn.execute(
+            text("DELETE FROM event_stats_rollups WHERE granularity = :granularity AND bucket < :cutoff"),
+            {"granularity": granularity, "cutoff": cutoff},
+        ).rowcount)
+    return deleted[0], deleted[1]
+
+
+def maintain(
+    engine: Engine, months_ahead: int, retention_months: int, archive_dir: Optional[str], minute_retention_days: int = 0
+) -> List[str]:
+    """
+    Creates upcoming partitions, prunes expired rollups and retires expired partitions, a retention of 0 keeps everything.
+    """
+
+    with engine.begin() as conn:
+        ensure_partitions(conn, months_ahead)
+
+    with engine.begin() as conn:
+        minute_rows, hour_rows = prune_rollups(conn, minute_retention_days, retention_months)
+    if minute_rows or hour_rows:
+        logger.info("Deleted %s minute and %s hour rollup rows", minute_rows, hour_rows)
+
+    if retention_months <= 0:
+        return []
+
+    return retire_partitions(engine, retention_months, archive_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create upcoming and retire expired EventFlo partitions")
+    parser.add_argument("--months-ahead", type=int, default=settings.partition_months_ahead)
+    parser.add_argument("--retention-months", type=int, default=settings.partition_retention_months)
+    parser.add_argument("--archive-dir", default=settings.partition_archive_dir or None)
+    parser.add_argument("--rollup-minute-retention-days", type=int, default=settings.rollup_minute_retention_days)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    from app.db.session import engine
+    retired = maintain(engine, args.months_ahead, args.retention_months, args.archive_dir, args.rollup_minute_retention_days)
+    logger.info("Partitions up to date, retired: %s", ", ".join(retired) or "none")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,119 @@
 # SQLALCHEMY - is a python SQL toolkit and Object Relational Mapper (ORM) that allows python to interact with database. Database have tables and python have classes so instead of we writing all the SQL queires this will map the pythons classes and objects to the tables directly so we just by few lines of python can access and communicate with db.
-from sqlalchemy import create_engine
+import threading
+import time
+import uuid
+
+from sqlalchemy import create_engine, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from app.config import settings
+from app.services.metrics import DB_POOL_WAIT_SECONDS
+
+# this is just a connection string to connect to the database named as eventflo, it comes from EVENTFLO_DATABASE_URL (default postgresql://localhost/eventflo)
+DATABASE_URL = settings.database_url
+# same database through the asyncpg driver, used by the async API endpoints
+ASYNC_DATABASE_URL = make_url(DATABASE_URL).set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+
+
+class PoolMetrics:
+    """
+    Counts pool checkouts and how long callers waited for a free connection.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        # pool checkouts happen from many threads at once, the lock keeps the counters consistent
+        self._lock = threading.Lock()
+
+    def record_checkout(self, wait_seconds: float, timed_out: bool):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_seconds_total += wait_seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+        # the same wait as a prometheus histogram, which unlike the totals above shows how the waits are distributed (p99 and so on)
+        DB_POOL_WAIT_SECONDS.labels(self.name).observe(wait_seconds)
+
+    def snapshot(self, pool) -> dict:
+        with self._lock:
+            return {
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+            }
+
+
+def _timed_pool_class(base, metrics: PoolMetrics):
+    # _do_get is where a queue pool hands out a connection, blocking when all of them are checked out,
+    # so timing it measures exactly the time spent waiting on the pool (and opening a new connection when needed).
+    class TimedPool(base):
+        pool_metrics = metrics
+
+        def _do_get(self):
+            start = time.perf_counter()
+            timed_out = False
+            try:
+                return super()._do_get()
+            except exc.TimeoutError:
+                timed_out = True
+                raise
+            finally:
+                metrics.record_checkout(time.perf_counter() - start, timed_out)
+
+    return TimedPool
+
+
+def create_db_engine(url: str, is_async: bool = False):
+    """
+    Builds a sync or async engine tuned by the EVENTFLO_DB_* settings.
+    """
 
-# this is just a connection string to connect to the database named as eventflo
-DATABASE_URL = "postgresql://localhost/eventflo"
+    metrics = PoolMetrics("async" if is_async else "sync")
+    options = dict(
+        echo=settings.db_echo,
+        poolclass=_timed_pool_class(AsyncAdaptedQueuePool if is_async else QueuePool, metrics),
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+    )
 
-# this will create a database connection to that eventflo db via the URL. echo is to log the sql queries in terminal for debugging purpose.
-engine = create_engine(DATABASE_URL, echo=True)
+    # startup parameters are sent once when a connection opens, so they cost no extra round trips.
+    # PgBouncer in transaction mode rejects most of them, there set statement_timeout on the db role instead (ALTER ROLE ... SET statement_timeout).
+    server_settings = {"application_name": settings.db_application_name}
+    if settings.db_statement_timeout_ms and not settings.db_pgbouncer:
+        server_settings["statement_timeout"] = str(settings.db_statement_timeout_ms)
+
+    if is_async:
+        connect_args = {"server_settings": server_settings}
+        if settings.db_pgbouncer:
+            # a pooled server connection is shared by many clients, so named prepared statements from one client would clash with (or be missing for) another.
+            connect_args["statement_cache_size"] = 0
+            connect_args["prepared_statement_cache_size"] = 0
+            connect_args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid.uuid4()}__"
+        return create_async_engine(url, connect_args=connect_args, **options)
+
+    # psycopg2 never uses server side prepared statements, so it needs nothing special for PgBouncer.
+    connect_args = {"application_name": server_settings.pop("application_name")}
+    if server_settings:
+        connect_args["options"] = " ".join(f"-c {key}={value}" for key, value in server_settings.items())
+    return create_engine(url, connect_args=connect_args, **options)
+
+
+# this will create a database connection to that eventflo db via the URL. SQL logging (echo) is off unless EVENTFLO_DB_ECHO is set, as logging every statement is slow under load.
+engine = create_db_engine(DATABASE_URL)
 
 # we cannot directly communicate with db after a connection is made instead, sessionmaker creates sessions say like workers or requests that communicates with db. And we will be calling this session local say like a machine that generates sessions via maker wherever needed in our entire app uniquely and we wont be using the same session for all the operations as that may lead to bugs.
 # autoflush is to send the changes like insert/update to db without commiting them. so this autocommit and autoflush is to disable after each operation so that we can have control over when and what to push to db and commit.
@@ -16,6 +123,35 @@ SessionLocal = sessionmaker(
     autocommit=False
 )
 
+# the API endpoints are async def, so they talk to the db through an async engine instead: while one request waits on postgres the event loop serves other requests,
+# rather than every in-flight request holding one of the thread pool's threads. the sync engine above stays for the worker, background processing and scripts.
+async_engine = create_db_engine(ASYNC_DATABASE_URL, is_async=True)
+
+# expire_on_commit=False keeps the loaded values on objects after commit, so returning them doesn't trigger another (async) query
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    autoflush=False,
+    expire_on_commit=False
+)
+
+
+# FastAPI dependency that gives every request its own AsyncSession and always closes it after the response, use it as `db: AsyncSession = Depends(get_async_db)`.
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def pool_status() -> dict:
+    """
+    Returns connection pool usage and wait metrics of both engines.
+    """
+
+    return {
+        "sync": engine.pool.pool_metrics.snapshot(engine.pool),
+        "async": async_engine.pool.pool_metrics.snapshot(async_engine.pool),
+    }
+
+
 # DB model is a python class that represents a table in the database. DdeclarativeBase is ORM engine that has all tables, columns, metadata mappping info. Its declared as base class for all the models to inherit from so that SQLAlchemy knows that these classes are special and should be treated as database tables.
 # Base is the container or registry that collects all database models, and inheritance is how a class regsiters itself into that registry or tells SQLAlchemy “I am a table.” So SQLAlchemy can see all the tables defined under base adn create or manipulate them at once.
 class Base(DeclarativeBase):
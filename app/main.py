@@ -1,13 +1,72 @@
 # this is to build application main file
 
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
 # fastapi is a modern, fast (high-performance) web framework for building APIs and setting communication btwn them, basically an application. 
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 
 # Importing the router defined in events module to include its endpoints in the main application, we set it as events_router to avoid confusion when we also import routers for other domains like users,payments etc in future.
 from app.api.events import router as events_router
+from app.api.health import router as health_router
+from app.api.metrics import router as metrics_router
+from app.config import settings
+from app.services.metrics import RequestMetricsMiddleware
+from app.services.notifications import event_notifier
+from app.services.processor import process_due_retries_in_background, recover_abandoned_events_in_background
+
+logger = logging.getLogger("eventflo")
+
+
+# in "background" mode there is no worker to run the retry scheduler, so the API process runs it: every few seconds due retries are
+# requeued with one UPDATE and processed in a thread. in "worker" mode the workers do this (see app/worker.py).
+# like a worker it also recovers what a crashed or stopped process left behind, every EVENTFLO_WORKER_STALE_AFTER / 2 seconds: events stuck in processing
+# are handed to the retry schedule and events still queued after EVENTFLO_WORKER_STALE_AFTER seconds are processed.
+async def retry_scheduler():
+    # the first sweep runs right after startup, the previous process may just have crashed
+    last_recovery = None
+    while True:
+        await asyncio.sleep(settings.retry_poll_interval)
+        try:
+            await asyncio.to_thread(process_due_retries_in_background)
+        except Exception:
+            logger.exception("Failed to process due retries")
+
+        if last_recovery is None or time.monotonic() - last_recovery >= settings.worker_stale_after / 2:
+            last_recovery = time.monotonic()
+            try:
+                await asyncio.to_thread(recover_abandoned_events_in_background, settings.worker_stale_after, settings.worker_batch_size)
+            except Exception:
+                logger.exception("Failed to recover abandoned events")
+
+
+# lifespan runs once per process: the code before yield on startup and after yield on shutdown.
+# here it keeps the LISTEN connection that pushes event completions to GET /events/{event_id}/wait open for the life of the app.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    event_notifier.start()
+    scheduler = asyncio.create_task(retry_scheduler()) if settings.processing_mode == "background" else None
+    yield
+    if scheduler is not None:
+        scheduler.cancel()
+        try:
+            await scheduler
+        except asyncio.CancelledError:
+            pass
+    await event_notifier.stop()
+
 
 # Creating an instance of FastAPI as our main web application
-app = FastAPI(title="EventFlo")
+# the endpoints return plain dicts, ORJSONResponse turns them into JSON with orjson, which is several times faster than the standard json module.
+app = FastAPI(title="EventFlo", lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# times every request for the eventflo_http_request_duration_seconds metric, served with the others at GET /metrics
+app.add_middleware(RequestMetricsMiddleware)
 
 # attaches all routes defined in events_router to the main FastAPI app with the "/events" prefix to path.
-app.include_router(events_router, prefix="/events")
\ No newline at end of file
+app.include_router(events_router, prefix="/events")
+app.include_router(health_router, prefix="/health")
+app.include_router(metrics_router)
\ No newline at end of file
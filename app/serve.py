@@ -0,0 +1,193 @@
+# SERVE: production launcher of the API, run it with `python -m app.serve --workers 8` instead of a single `uvicorn app.main:app` process.
+# the parent process imports the app once (models, the compiled rules table, numpy, ...), binds the listening socket and then forks the server processes:
+# each one starts with all of that already loaded instead of importing it again, and shares the parent's memory pages until it writes to them.
+# all of them accept connections from the same socket, so the kernel spreads requests over every core. the parent serves nothing itself,
+# it replaces a server process that dies and, on SIGTERM or Ctrl+C, lets every server finish its in-flight requests before exiting.
+import argparse
+import gc
+import glob
+import importlib.util
+import logging
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
+
+from app.config import settings
+
+logger = logging.getLogger("eventflo.serve")
+
+# seconds the parent waits for a server process beyond the graceful timeout (lifespan shutdown, closing connections) before killing it
+_KILL_GRACE = 5.0
+
+
+def _event_loop_and_http_parser():
+    # uvloop and httptools are C implementations of the asyncio event loop and the HTTP parser, noticeably faster than the pure python ones.
+    # they are optional (pip install uvloop httptools), without them uvicorn's standard asyncio loop and h11 parser are used.
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    return loop, http
+
+
+def _prepare_metrics_dir(workers: int):
+    # prometheus_client decides between in-memory and file-backed metrics when it is imported, so with several server processes the shared
+    # directory has to be in the environment before the app (and prometheus_client with it) is imported. GET /metrics then adds up every process.
+    if workers <= 1:
+        return None
+
+    metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if metrics_dir:
+        # files left by an earlier run would be added to this run's numbers, so the directory is emptied first
+        for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+            os.remove(path)
+        return None
+
+    metrics_dir = tempfile.mkdtemp(prefix="eventflo-metrics-")
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+    # returned so the directory we created is removed again on exit
+    return metrics_dir
+
+
+def _bind(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    # lets a restarted server bind right away instead of waiting for the old connections' TIME_WAIT to expire
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _serve(app, sock: socket.socket, args, loop: str, http: str):
+    """
+    Runs one uvicorn server on the inherited socket, in a forked child. returns when the server has shut down.
+    """
+
+    import uvicorn
+
+    from app.db.session import async_engine, engine
+
+    # the parent never connects to the db, but should anything have opened a pooled connection before the fork, sharing it between
+    # processes would corrupt it. dispose(close=False) drops the inherited pools without closing sockets another process may own.
+    engine.dispose(close=False)
+    async_engine.sync_engine.dispose(close=False)
+
+    # uvicorn installs its own SIGTERM/SIGINT handlers: the first signal stops accepting connections and waits up to timeout_graceful_shutdown
+    # seconds for in-flight requests, including the BackgroundTasks processing they scheduled, then runs the lifespan shutdown. events whose
+    # processing is still cut off stay in the db, queued or processing, and are recovered by the retry scheduler of any server process running
+    # later (see retry_scheduler in app/main.py) or, in worker mode, by the workers, so nothing is lost either way.
+    config = uvicorn.Config(
+        app,
+        loop=loop,
+        http=http,
+        lifespan="on",
+        access_log=args.access_log,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        backlog=args.backlog,
+    )
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def _fork_server(app, sock: socket.socket, args, loop: str, http: str) -> int:
+    pid = os.fork()
+    if pid:
+        return pid
+
+    # in the child: the parent's signal handlers were inherited, uvicorn replaces them once it runs
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    status = 0
+    try:
+        _serve(app, sock, args, loop, http)
+    except BaseException:
+        logger.exception("Server process %s failed", os.getpid())
+        status = 1
+    finally:
+        # os._exit skips the parent's atexit handlers (they belong to the parent, e.g. removing the metrics directory), so flush the logs by hand
+        logging.shutdown()
+        os._exit(status)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the EventFlo API with several pre-forked server processes")
+    parser.add_argument("--host", default=settings.serve_host)
+    parser.add_argument("--port", type=int, default=settings.serve_port)
+    parser.add_argument("--workers", type=int, default=settings.serve_workers, help="server processes (default: one per CPU core)")
+    parser.add_argument("--graceful-timeout", type=float, default=settings.serve_graceful_timeout)
+    parser.add_argument("--access-log", action=argparse.BooleanOptionalAction, default=settings.serve_access_log)
+    parser.add_argument("--backlog", type=int, default=2048, help="pending connections the listening socket queues")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(process)d %(levelname)s %(message)s")
+    workers = args.workers or os.cpu_count() or 1
+    metrics_dir = _prepare_metrics_dir(workers)
+
+    # 1. preload everything once: importing the app imports the models, compiles the rules table and loads numpy, and configure_mappers
+    # does sqlalchemy's one-off mapper setup that every process would otherwise do on its first query.
+    from sqlalchemy.orm import configure_mappers
+
+    from app.main import app
+
+    configure_mappers()
+    loop, http = _event_loop_and_http_parser()
+    sock = _bind(args.host, args.port, args.backlog)
+
+    # 2. move everything loaded so far out of the garbage collector's reach. the collector would otherwise touch these objects in every child
+    # and make the kernel copy the memory pages they share with the parent.
+    gc.freeze()
+
+    logger.info("Serving on %s:%s with %s processes (loop=%s, http=%s)", args.host, args.port, workers, loop, http)
+    children = {_fork_server(app, sock, args, loop, http) for _ in range(workers)}
+
+    # 3. supervise. SIGTERM (docker/systemd stop) and Ctrl+C are passed on to every server as SIGTERM, which drains it gracefully.
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    deadline = None
+    while children:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if not pid:
+            if stopping:
+                deadline = deadline or time.monotonic() + args.graceful_timeout + _KILL_GRACE
+                if time.monotonic() > deadline:
+                    logger.warning("Killing %s server processes that didn't stop in time", len(children))
+                    for child in children:
+                        os.kill(child, signal.SIGKILL)
+                    deadline = float("inf")
+            time.sleep(0.2)
+            continue
+
+        children.discard(pid)
+        if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+            from prometheus_client import multiprocess
+            multiprocess.mark_process_dead(pid)
+
+        if not stopping:
+            # an unexpected exit (crash, OOM kill): start a replacement from the preloaded parent, after a pause so a server that fails on startup doesn't spin
+            logger.warning("Server process %s exited with status %s, starting a new one", pid, os.waitstatus_to_exitcode(status))
+            time.sleep(1)
+            children.add(_fork_server(app, sock, args, loop, http))
+
+    sock.close()
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+    logger.info("All server processes stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# CACHE: keeps recently read events in memory so clients polling GET /events/{event_id} don't hit postgres on every poll.
+# CacheBackend is the interface the app codes against, TTLCache is the in-process implementation. a shared cache (e.g. redis) can later be plugged in
+# by writing another CacheBackend and assigning it to event_cache, without touching the endpoints or the processor.
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional
+
+from app.config import settings
+
+
+class CacheBackend(ABC):
+    """
+    Interface every event cache backend implements.
+    """
+
+    @abstractmethod
+    def get(self, key: Hashable) -> Optional[Any]:
+        ...
+
+    @abstractmethod
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, key: Hashable) -> None:
+        ...
+
+    def delete_many(self, keys: Iterable[Hashable]) -> None:
+        for key in keys:
+            self.delete(key)
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        ...
+
+
+class TTLCache(CacheBackend):
+    """
+    Thread-safe in-process cache with per-entry expiry and least-recently-used eviction.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        # OrderedDict remembers insertion order and move_to_end is O(1), so the first entry is always the least recently used one.
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        # the async endpoints and the background processing threads use the cache at the same time
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        if self.max_size <= 0:
+            return
+
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_many(self, keys: Iterable[Hashable]) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# cache for GET /events/{event_id} responses keyed by event_id. the processor invalidates an entry whenever it changes that event's status or stores its result.
+# invalidation only reaches this process, so entries of events still in flight get a short TTL (events processed by a separate worker show up within that time).
+event_cache: CacheBackend = TTLCache(max_size=settings.event_cache_size, ttl=settings.event_cache_ttl)
+
+# idempotency keys recently accepted by this process, mapped to the (event_id, created_at) they created. a retried submission is recognised here without touching the db.
+# a miss proves nothing (another process may have seen the key, or it was evicted), so the database stays the source of truth for keys not found here.
+recent_idempotency_keys: CacheBackend = TTLCache(max_size=settings.idempotency_cache_size, ttl=settings.idempotency_cache_ttl)
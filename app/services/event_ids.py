@@ -0,0 +1,71 @@
+# EVENT IDS: event ids are UUIDv7, whose first 48 bits are the unix time in milliseconds. the id is generated from the very created_at stored with the event,
+# so any event_id tells which millisecond, and with it which monthly partition, the event was created in. lookups by id add that created_at range to their
+# WHERE clause and postgres only reads that one partition instead of probing the index of every month still kept.
+# events created before ids were UUIDv7 (random uuid4 ids) carry no timestamp, they are still found, just without the pruning.
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy import and_
+
+from app.db.models import Event
+
+_EPOCH = datetime(1970, 1, 1)
+_MILLISECOND = timedelta(milliseconds=1)
+
+
+def new_event_id(created_at: datetime) -> uuid.UUID:
+    """
+    Returns a UUIDv7 for an event created at `created_at` (naive UTC): 48 bits of milliseconds, the version, the variant and 74 random bits (12 + 62).
+    """
+
+    # timedelta // timedelta is exact integer arithmetic, a float timestamp could round into the next millisecond
+    milliseconds = (created_at - _EPOCH) // _MILLISECOND
+    random_bits = int.from_bytes(os.urandom(10), "big")
+    value = (
+        (milliseconds << 80)
+        | (0x7 << 76)
+        | (((random_bits >> 62) & 0xFFF) << 64)
+        | (0b10 << 62)
+        | (random_bits & ((1 << 62) - 1))
+    )
+    return uuid.UUID(int=value)
+
+
+def created_at_range(event_id: uuid.UUID) -> Optional[Tuple[datetime, datetime]]:
+    """
+    Returns the millisecond [start, end) the event with this id was created in, or None for ids that aren't UUIDv7.
+    """
+
+    if event_id.version != 7:
+        return None
+    start = _EPOCH + (event_id.int >> 80) * _MILLISECOND
+    return start, start + _MILLISECOND
+
+
+def event_lookup(event_id: uuid.UUID):
+    """
+    WHERE condition finding one event by id, bounded by its created_at when the id carries it.
+    """
+
+    bounds = created_at_range(event_id)
+    if bounds is None:
+        return Event.event_id == event_id
+    return and_(Event.event_id == event_id, Event.created_at >= bounds[0], Event.created_at < bounds[1])
+
+
+def events_lookup(event_ids: Iterable[uuid.UUID]):
+    """
+    WHERE condition finding many events by id, bounded by the created_at range they span when every id carries it.
+    """
+
+    event_ids = list(event_ids)
+    bounds = [created_at_range(event_id) for event_id in event_ids]
+    if not bounds or None in bounds:
+        return Event.event_id.in_(event_ids)
+    return and_(
+        Event.event_id.in_(event_ids),
+        Event.created_at >= min(start for start, _ in bounds),
+        Event.created_at < max(end for _, end in bounds),
+    )
@@ -0,0 +1,174 @@
+import json
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.db.models import Event, EventIdempotencyKey, EventStatus
+from app.services.event_ids import new_event_id
+from app.services.rules import extract_hot_field
+
+# upper bound on how many events one batch request may carry, so a single request cannot hold a DB transaction (and the API worker) for too long.
+MAX_BATCH_SIZE = 10000
+
+# longest idempotency key accepted, matches the column size
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+
+def parse_batch_body(body: bytes, content_type: str) -> List[Any]:
+    """
+    Turns a batch request body into a list of raw items.
+
+    Accepts either a JSON array or NDJSON (one JSON object per line).
+    """
+
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        # each non-empty line is one event, blank lines are simply skipped
+        return [json.loads(line) for line in body.splitlines() if line.strip()]
+
+    items = json.loads(body)
+    if not isinstance(items, list):
+        raise ValueError("Batch body must be a JSON array of events")
+    return items
+
+
+def validate_batch_item(item: Any) -> Tuple[Optional[Dict[str, Any]], str]:
+    """
+    Validates one raw batch item.
+
+    Returns the row to insert and an empty string, or None and the reason the item was rejected.
+    """
+
+    if not isinstance(item, dict):
+        return None, "Event must be a JSON object"
+
+    event_type = item.get("event_type")
+    payload = item.get("payload")
+    source = item.get("source")
+    idempotency_key = item.get("idempotency_key")
+
+    if not isinstance(event_type, str) or not event_type:
+        return None, "event_type must be a non-empty string"
+    if not isinstance(payload, dict):
+        return None, "payload must be a JSON object"
+    if source is not None and not isinstance(source, str):
+        return None, "source must be a string"
+    if idempotency_key is not None and (
+        not isinstance(idempotency_key, str) or not 0 < len(idempotency_key) <= MAX_IDEMPOTENCY_KEY_LENGTH
+    ):
+        return None, f"idempotency_key must be a non-empty string of at most {MAX_IDEMPOTENCY_KEY_LENGTH} characters"
+
+    return {"event_type": event_type, "payload": payload, "source": source, "idempotency_key": idempotency_key}, ""
+
+
+@dataclass(frozen=True)
+class IngestedEvent:
+    """
+    Outcome of ingesting one item: the event it created, or for a duplicate the event created by the first submission with the same idempotency key.
+    """
+
+    event_id: uuid.UUID
+    created_at: datetime
+    # None only when the original event was already retired with its partition
+    status: Optional[EventStatus]
+    duplicate: bool
+
+
+def insert_events(db: Session, items: List[Dict[str, Any]]) -> List[IngestedEvent]:
+    """
+    Inserts many events with multi-row INSERTs, skipping items whose idempotency key was seen before.
+
+    Returns one IngestedEvent per item in input order.
+    """
+
+    # ids and timestamps are generated here so the idempotency keys can point at their events before those are inserted
+    now = datetime.utcnow()
+    rows = []
+    for item in items:
+        # the value the rules will compare is copied into its own columns, so processing doesn't need the whole payload
+        hot_field, hot_value = extract_hot_field(item["event_type"], item["payload"])
+        rows.append({
+            "event_id": new_event_id(now),
+            "event_type": item["event_type"],
+            "source": item.get("source"),
+            "status": EventStatus.queued,
+            "payload": item["payload"],
+            "hot_field": hot_field,
+            "hot_value": hot_value,
+            "idempotency_key": item.get("idempotency_key"),
+            "created_at": now,
+        })
+
+    # the first item carrying a key claims it, later items with the same key in this batch are duplicates of that first one
+    first_with_key = {}
+    for index, row in enumerate(rows):
+        if row["idempotency_key"] is not None:
+            first_with_key.setdefault(row["idempotency_key"], index)
+
+    existing = {}
+    if first_with_key:
+        claimed = _claim_idempotency_keys(db, [rows[index] for index in first_with_key.values()])
+        unclaimed = [key for key in first_with_key if key not in claimed]
+        if unclaimed:
+            existing = _existing_events(db, unclaimed)
+
+    results = []
+    new_rows = []
+    for index, row in enumerate(rows):
+        key = row["idempotency_key"]
+        if key in existing:
+            results.append(existing[key])
+        elif key is None or first_with_key[key] == index:
+            new_rows.append(row)
+            results.append(IngestedEvent(row["event_id"], row["created_at"], EventStatus.queued, False))
+        else:
+            first = rows[first_with_key[key]]
+            results.append(IngestedEvent(first["event_id"], first["created_at"], EventStatus.queued, True))
+
+    # passing a list of dicts to an insert() makes SQLAlchemy batch the rows into multi-row INSERT ... VALUES (...), (...) statements
+    # instead of one round trip per row. the ids are already known, so nothing has to be sent back with RETURNING.
+    if new_rows:
+        db.execute(insert(Event), new_rows)
+
+    return results
+
+
+def _claim_idempotency_keys(db: Session, rows: List[Dict[str, Any]]) -> Set[str]:
+    # ON CONFLICT DO NOTHING skips keys that already exist, so RETURNING only lists the keys this call added, i.e. the ones whose events are new.
+    # if another transaction is inserting the same key right now, postgres makes us wait for it and then reports the key as existing.
+    # keys go in sorted order, so two batches sharing keys take their locks in the same order and can't deadlock each other.
+    key_rows = sorted(
+        (
+            {"idempotency_key": row["idempotency_key"], "event_id": row["event_id"], "event_created_at": row["created_at"]}
+            for row in rows
+        ),
+        key=lambda key_row: key_row["idempotency_key"],
+    )
+    stmt = (
+        pg_insert(EventIdempotencyKey)
+        .on_conflict_do_nothing(index_elements=[EventIdempotencyKey.idempotency_key])
+        .returning(EventIdempotencyKey.idempotency_key)
+    )
+    return set(db.scalars(stmt, key_rows))
+
+
+def _existing_events(db: Session, keys: List[str]) -> Dict[str, IngestedEvent]:
+    # created_at is part of the join, so postgres only looks into the partition holding each original event
+    rows = db.execute(
+        select(
+            EventIdempotencyKey.idempotency_key,
+            EventIdempotencyKey.event_id,
+            EventIdempotencyKey.event_created_at,
+            Event.status,
+        )
+        .outerjoin(
+            Event,
+            and_(Event.event_id == EventIdempotencyKey.event_id, Event.created_at == EventIdempotencyKey.event_created_at),
+        )
+        .where(EventIdempotencyKey.idempotency_key.in_(keys))
+    )
+    return {row.idempotency_key: IngestedEvent(row.event_id, row.event_created_at, row.status, True) for row in rows}
@@ -0,0 +1,131 @@
+# NOTIFICATIONS: tells waiting API requests the moment an event finishes processing, instead of clients polling GET /events/{event_id}.
+# the processor sends a postgres NOTIFY in the same transaction that marks events completed/failed, and every API process keeps one connection LISTENing on that channel.
+# as postgres delivers a notification to every listener only after the transaction commits, this works across any number of API processes, workers and hosts.
+import asyncio
+import logging
+from contextlib import contextmanager
+from typing import Dict, Iterable, Set, Tuple
+from uuid import UUID
+
+import asyncpg
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+from sqlalchemy.types import Text
+
+from app.config import settings
+from app.db.session import DATABASE_URL
+from app.services.cache import event_cache
+
+logger = logging.getLogger("eventflo.notifications")
+
+NOTIFY_CHANNEL = "event_status"
+
+# one statement sends a notification per event, so a whole batch costs a single round trip
+_NOTIFY_MANY = text(
+    "SELECT pg_notify(:channel, message) FROM unnest(:messages) AS message"
+).bindparams(bindparam("messages", type_=ARRAY(Text)))
+
+
+def notify_status_changes(db: Session, changes: Iterable[Tuple[UUID, str]]) -> None:
+    """
+    Queues a NOTIFY for each (event_id, status) pair, delivered to listeners when the surrounding transaction commits.
+    """
+
+    messages = [f"{event_id}:{status}" for event_id, status in changes]
+    if messages:
+        db.execute(_NOTIFY_MANY, {"channel": NOTIFY_CHANNEL, "messages": messages})
+
+
+class EventNotifier:
+    """
+    Listens for event status notifications and wakes up requests waiting on those events.
+    """
+
+    def __init__(self, dsn: str, reconnect_delay: float = 1.0):
+        self.dsn = dsn
+        self.reconnect_delay = reconnect_delay
+        self.connected = False
+        # every waiting request registers an asyncio.Event under its event_id, a notification sets all of them
+        self._waiters: Dict[UUID, Set[asyncio.Event]] = {}
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._listen_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @contextmanager
+    def subscribe(self, event_id: UUID):
+        """
+        Registers interest in an event, the yielded asyncio.Event is set whenever that event's status changes.
+        """
+
+        signal = asyncio.Event()
+        self._waiters.setdefault(event_id, set()).add(signal)
+        try:
+            yield signal
+        finally:
+            waiters = self._waiters.get(event_id)
+            if waiters is not None:
+                waiters.discard(signal)
+                if not waiters:
+                    del self._waiters[event_id]
+
+    async def _listen_forever(self):
+        # keeps one LISTEN connection open, reconnecting after a short pause if it drops
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(self.dsn)
+                closed = asyncio.Event()
+                connection.add_termination_listener(lambda _: closed.set())
+                await connection.add_listener(NOTIFY_CHANNEL, self._on_notification)
+                self.connected = True
+                # anything that finished while we were disconnected was never announced, so let every waiter re-check
+                self._wake_all()
+                await closed.wait()
+            except Exception:
+                logger.exception("Event notification listener failed, reconnecting")
+            finally:
+                self.connected = False
+                # on every way out (shutdown, a failed add_listener, a dropped connection) the connection is closed, so reconnects never leak one
+                if connection is not None and not connection.is_closed():
+                    try:
+                        await connection.close()
+                    except Exception:
+                        # a half-broken connection can fail the graceful close, terminate() drops it without talking to the server
+                        connection.terminate()
+
+            await asyncio.sleep(self.reconnect_delay)
+
+    def _on_notification(self, _connection, _pid, _channel, message: str):
+        event_id, _, _status = message.partition(":")
+        try:
+            event_id = UUID(event_id)
+        except ValueError:
+            return
+
+        # the event changed, possibly in another process, so a cached copy of it here is stale too
+        event_cache.delete(event_id)
+        for signal in self._waiters.get(event_id, ()):
+            signal.set()
+
+    def _wake_all(self):
+        for waiters in self._waiters.values():
+            for signal in waiters:
+                signal.set()
+
+
+# asyncpg wants a plain postgresql:// DSN without the SQLAlchemy driver name.
+event_notifier = EventNotifier(
+    make_url(settings.notify_database_url or DATABASE_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+)
@@ -1,9 +1,32 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import DateTime, and_, bindparam, case, cast, func, insert, literal, null, select, tuple_, update
 from sqlalchemy.orm import Session
 # this session prvided by sqlalchemy defines what a database session is capable of doing like querying, inserting, updating, deleting rows in the table.
 # sessionLocal creates session classes after making a connection to db for operating on db, and we use this when its passed to this process event fucntion.
 
+from app.config import settings
 from app.db.models import Event, EventProcessingResult, EventStatus
-from app.services.rules import classify_event
+from app.db.session import SessionLocal
+from app.services.cache import event_cache
+from app.services.event_ids import event_lookup, events_lookup
+from app.services.metrics import EVENTS_PROCESSED, QUEUE_WAIT_SAMPLES_PER_BATCH, QUEUE_WAIT_SECONDS, StageTimer
+from app.services.notifications import notify_status_changes
+from app.services.rollups import record_classifications
+from app.services.rules import classify_event, classify_events, hot_payload
+
+logger = logging.getLogger("eventflo.processor")
+
+# most retry scheduler runs find a handful of due events, this only caps a huge backlog (e.g. after a db outage) so one UPDATE stays reasonably sized.
+MAX_RETRIES_PER_RUN = 10000
+
+
+class ClassificationError(Exception):
+    """
+    The rules could not classify an event's payload. retrying gives the same result, so such events are failed right away.
+    """
 
 # Session is a type hint indicating that the db parameter is expected to be an instance of SQLAlchemy's Session class like sessionLocal() object created in events.py and passed here when process_event is called as background task.
 def process_event(event_id, db: Session):
@@ -11,10 +34,13 @@ def process_event(event_id, db: Session):
     Processes a single event end-to-end.
     """
 
+    # times each stage below for the eventflo_processing_stage_seconds metric (see app/services/metrics.py)
+    timer = StageTimer("single")
+
     try:
         # 1. Fetch event
         # query(event) means select * from event table
-        event = db.query(Event).filter(Event.event_id == event_id).first()
+        event = db.query(Event).filter(event_lookup(event_id)).first()
 
         if not event:
             raise ValueError("Event not found")
@@ -23,13 +49,22 @@ def process_event(event_id, db: Session):
         event.status = EventStatus.processing
         # we commit here because even if the app crashes later, you still know processing started
         db.commit()
+        # every status change drops the cached GET /events/{event_id} response so pollers see it right away
+        event_cache.delete(event_id)
+        QUEUE_WAIT_SECONDS.observe((datetime.utcnow() - event.created_at).total_seconds())
+        timer.stage("fetch")
 
         # 3. Apply business rules
-        classification = classify_event(event.event_type, event.payload)
+        try:
+            classification = classify_event(event.event_type, event.payload)
+        except Exception as e:
+            raise ClassificationError(str(e)) from e
+        timer.stage("classify")
 
         # 4. Store processing result
         result = EventProcessingResult(
             event_id=event.event_id,
+            event_created_at=event.created_at,
             severity=classification.severity,
             classification_reason=classification.classification_reason,
             recommendation=classification.recommendation,
@@ -37,19 +72,429 @@ def process_event(event_id, db: Session):
         )
         # add just stages the object for insertion, it doesn't push to db until commit is called
         db.add(result)
+        # count the outcome in the dashboard rollups, committed (or rolled back) together with the result
+        record_classifications(db, [(event.created_at, event.event_type, classification.severity, classification.should_escalate)])
 
         # 5. Mark event as completed
         event.status = EventStatus.completed
+        # the notification is only delivered if this commit succeeds, and wakes up anyone waiting on GET /events/{event_id}/wait
+        notify_status_changes(db, [(event_id, EventStatus.completed.value)])
+        # flush sends the INSERT and UPDATE now, so writing and committing show up as separate stages
+        db.flush()
+        timer.stage("persist")
         db.commit()
+        timer.stage("commit")
+        event_cache.delete(event_id)
+        EVENTS_PROCESSED.labels(EventStatus.completed.value).inc()
 
     except Exception as e:
         db.rollback()
 
-        # If event exists, mark it as failed
+        # If event exists, mark it as failed when the rules rejected it, anything else (db errors, lock timeouts, ...) is likely transient so it gets retried later
         # locals() is a dictionary of local variables defined in this current function
         if 'event' in locals() and event:
-            event.status = EventStatus.failed
-            event.error_message = str(e)
+            if isinstance(e, ClassificationError):
+                event.status = EventStatus.failed
+                event.error_message = str(e)
+                notify_status_changes(db, [(event.event_id, EventStatus.failed.value)])
+                db.commit()
+                EVENTS_PROCESSED.labels(EventStatus.failed.value).inc()
+            else:
+                outcomes = _schedule_retries(db, event_lookup(event_id), str(e))
+                db.commit()
+                _count_outcomes(outcomes)
+            event_cache.delete(event_id)
+
+        raise
+
+def process_event_in_background(event_id):
+    """
+    Runs process_event with a session of its own, for BackgroundTasks scheduled by the async API endpoints.
+    """
+
+    # the endpoint's AsyncSession is closed once the response is sent, and sync processing can't use it anyway, so the task opens a fresh sync session.
+    db = SessionLocal()
+    try:
+        process_event(event_id, db)
+    finally:
+        db.close()
+
+
+def process_events_in_background(event_ids):
+    """
+    Runs process_events with a session of its own, for BackgroundTasks scheduled by the async API endpoints.
+    """
+
+    db = SessionLocal()
+    try:
+        process_events(event_ids, db)
+    finally:
+        db.close()
+
+
+def process_events(event_ids, db: Session) -> int:
+    """
+    Processes a batch of queued events in a single transaction with set-based statements.
+    """
+
+    if not event_ids:
+        return 0
+
+    return _process_batch(db, events_lookup(event_ids))
+
+
+def process_queued_events(db: Session, limit: int, stale_before: Optional[datetime] = None) -> int:
+    """
+    Claims up to `limit` of the oldest queued events and processes them as one batch, only those last updated before `stale_before` when given.
+    """
+
+    return _process_batch(db, Event.updated_at < stale_before if stale_before is not None else None, limit)
+
+
+def _process_batch(db: Session, condition, limit=None) -> int:
+    # 1. Claim the events and mark them processing with one UPDATE ... RETURNING.
+    # the subquery picks queued rows with FOR UPDATE SKIP LOCKED, so rows another worker is busy with are skipped instead of waited on
+    # and any number of workers (threads, processes or hosts) can claim from the same table at once without ever getting the same event.
+    # it returns (event_id, created_at) pairs and the UPDATE matches both: with created_at postgres looks each row up in its own monthly partition only,
+    # matching on event_id alone would probe the primary key of every partition for every claimed row.
+    claimable = select(Event.event_id, Event.created_at).where(Event.status == EventStatus.queued)
+    if condition is not None:
+        claimable = claimable.where(condition)
+    if limit is not None:
+        claimable = claimable.order_by(Event.created_at).limit(limit)
+
+    timer = StageTimer("batch")
+    claimed = db.execute(
+        update(Event)
+        .where(tuple_(Event.event_id, Event.created_at).in_(claimable.with_for_update(skip_locked=True)))
+        .values(status=EventStatus.processing)
+        .returning(
+            Event.event_id,
+            Event.created_at,
+            Event.event_type,
+            Event.hot_field,
+            Event.hot_value,
+            # the rules only need the hot value copied out at ingest, the payload is sent back just for the events that don't have one
+            case((Event.hot_field.is_(None), Event.payload), else_=null()).label("payload"),
+        )
+        .execution_options(synchronize_session=False)
+    ).all()
+
+    if not claimed:
+        db.commit()
+        return 0
+
+    claimed_at = datetime.utcnow()
+    timer.stage("fetch")
+
+    # created_at is the partition key, adding it to the statements below lets postgres go straight to the right monthly partition(s)
+    created_ats = {row.event_id: row.created_at for row in claimed}
+
+    try:
+        # 2. Classify the whole batch in memory.
+        results, failures = _classify_batch(claimed, _rule_payloads(db, claimed))
+        timer.stage("classify")
+
+        # 3. Write every result with one multi-row INSERT and flip statuses with one UPDATE per outcome.
+        # nothing is committed until all of it went through, so a crash leaves the batch queued instead of half done.
+        if results:
+            db.execute(insert(EventProcessingResult), results)
+            db.execute(
+                update(Event)
+                .where(
+                    Event.event_id.in_([result["event_id"] for result in results]),
+                    Event.created_at >= min(result["event_created_at"] for result in results),
+                )
+                .values(status=EventStatus.completed)
+                .execution_options(synchronize_session=False)
+            )
+            event_types = {row.event_id: row.event_type for row in claimed}
+            record_classifications(
+                db,
+                (
+                    (result["event_created_at"], event_types[result["event_id"]], result["severity"], result["should_escalate"])
+                    for result in results
+                ),
+            )
+        if failures:
+            _mark_failed(db, failures, created_ats)
+
+        # 4. Announce the outcome of every event, delivered to waiting requests once the commit below succeeds.
+        notify_status_changes(
+            db,
+            [(result["event_id"], EventStatus.completed.value) for result in results]
+            + [(event_id, EventStatus.failed.value) for event_id in failures],
+        )
+        timer.stage("persist")
+        db.commit()
+        timer.stage("commit")
+        event_cache.delete_many(row.event_id for row in claimed)
+
+        # recorded only once the batch is committed, so events retried one by one after a failed batch aren't counted twice
+        for row in claimed[::max(1, len(claimed) // QUEUE_WAIT_SAMPLES_PER_BATCH)]:
+            QUEUE_WAIT_SECONDS.observe((claimed_at - row.created_at).total_seconds())
+        EVENTS_PROCESSED.labels(EventStatus.completed.value).inc(len(results))
+        EVENTS_PROCESSED.labels(EventStatus.failed.value).inc(len(failures))
+
+    except Exception as e:
+        db.rollback()
+
+        # the rollback put the whole batch back to queued. a single event gets scheduled for a retry on its own,
+        # a bigger batch is retried one event at a time so only the event(s) actually causing the error end up retried.
+        if len(claimed) == 1:
+            # classification errors were already handled above, so this is a db error, lock timeout or similar: try again later
+            logger.exception("Failed to process event %s, scheduling a retry", claimed[0].event_id)
+            outcomes = _schedule_retries(
+                db, and_(Event.event_id == claimed[0].event_id, Event.created_at == claimed[0].created_at), str(e)
+            )
             db.commit()
+            event_cache.delete(claimed[0].event_id)
+            _count_outcomes(outcomes)
+        else:
+            for row in claimed:
+                _process_batch(db, and_(Event.event_id == row.event_id, Event.created_at == row.created_at))
+
+    return len(claimed)
+
+
+def _rule_payloads(db: Session, claimed):
+    """
+    Returns, for every claimed row, the payload the rules are run on: the full payload or the part of it rebuilt from the hot columns.
+    """
+
+    payloads = []
+    missing = []
+    for row in claimed:
+        payload = row.payload
+        if payload is None:
+            payload = hot_payload(row.event_type, row.hot_field, row.hot_value)
+            if payload is None:
+                missing.append(row)
+        payloads.append(payload)
+
+    # only when the rules file changed since these events were ingested: their hot value belongs to another field, so read their payloads after all
+    if missing:
+        full = dict(
+            db.execute(
+                select(Event.event_id, Event.payload).where(
+                    Event.event_id.in_([row.event_id for row in missing]),
+                    Event.created_at >= min(row.created_at for row in missing),
+                )
+            ).all()
+        )
+        payloads = [full[row.event_id] if payload is None else payload for row, payload in zip(claimed, payloads)]
+
+    return payloads
+
+
+def _classify_batch(claimed, payloads):
+    """
+    Classifies claimed rows, returning result rows for event_processing_results and the error of every event that failed.
+    """
+
+    try:
+        columns = classify_events([row.event_type for row in claimed], payloads)
+    except Exception:
+        pass
+    else:
+        results = columns.to_rows([row.event_id for row in claimed])
+        for result, row in zip(results, claimed):
+            result["event_created_at"] = row.created_at
+        return results, {}
+
+    # one bad payload makes the vectorized call raise for the whole batch, so go over it row by row to fail only that event
+    results = []
+    failures = {}
+    for row, payload in zip(claimed, payloads):
+        try:
+            classification = classify_event(row.event_type, payload)
+        except Exception as e:
+            failures[row.event_id] = str(e)
+            continue
+
+        results.append({
+            "event_id": row.event_id,
+            "event_created_at": row.created_at,
+            "severity": classification.severity,
+            "classification_reason": classification.classification_reason,
+            "recommendation": classification.recommendation,
+            "should_escalate": classification.should_escalate,
+        })
+
+    return results, failures
+
+
+def _mark_failed(db: Session, failures, created_ats):
+    # every failed event has its own error message, so this is one UPDATE sent with many parameter sets (executemany)
+    events = Event.__table__
+    db.execute(
+        update(events)
+        .where(
+            events.c.event_id == bindparam("failed_event_id"),
+            events.c.created_at == bindparam("failed_created_at"),
+        )
+        .values(status=EventStatus.failed, error_message=bindparam("failed_error")),
+        [
+            {"failed_event_id": event_id, "failed_created_at": created_ats[event_id], "failed_error": error}
+            for event_id, error in failures.items()
+        ],
+    )
+
+
+def _schedule_retries(db: Session, condition, error: str):
+    """
+    Counts a failed attempt for every event matching `condition` and schedules its retry, or dead-letters it when it is out of attempts.
+    """
+
+    # SET expressions all see the row as it was before the UPDATE, so Event.attempts here is the number of earlier failed attempts.
+    attempts = Event.attempts + 1
+    exhausted = attempts >= settings.retry_max_attempts
+    # exponential backoff with jitter, computed by postgres for every row (random() differs per row) so one statement schedules any number of events
+    delay = func.least(settings.retry_max_delay, settings.retry_base_delay * func.power(2, Event.attempts)) * (0.5 + func.random() * 0.5)
+
+    outcomes = db.execute(
+        update(Event)
+        .where(condition)
+        .values(
+            attempts=attempts,
+            status=cast(
+                case((exhausted, EventStatus.dead_letter.value), else_=EventStatus.retrying.value),
+                Event.status.type,
+            ),
+            next_attempt_at=case(
+                (exhausted, null()),
+                else_=literal(datetime.utcnow(), DateTime) + func.make_interval(0, 0, 0, 0, 0, 0, delay),
+            ),
+            error_message=error,
+        )
+        .returning(Event.event_id, Event.status)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+    # dead_letter is final, so anyone waiting on GET /events/{event_id}/wait is told once the caller commits
+    notify_status_changes(db, [(event_id, status.value) for event_id, status in outcomes if status == EventStatus.dead_letter])
+    return outcomes
+
+
+def _count_outcomes(outcomes):
+    for _, status in outcomes:
+        EVENTS_PROCESSED.labels(status.value).inc()
+
+
+def requeue_due_retries(db: Session, limit: int = MAX_RETRIES_PER_RUN):
+    """
+    Puts every event whose retry is due back to queued with one UPDATE, returning their ids.
+    """
+
+    # the partial index ix_events_retry_due holds exactly the retrying events ordered by next_attempt_at, so finding the due ones is one short range scan.
+    # SKIP LOCKED lets several workers run this at the same time without waiting on each other.
+    # (event_id, created_at) pairs, so the UPDATE finds each row in its own partition (see _process_batch)
+    due = (
+        select(Event.event_id, Event.created_at)
+        .where(Event.status == EventStatus.retrying, Event.next_attempt_at <= datetime.utcnow())
+        .order_by(Event.next_attempt_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    requeued = db.scalars(
+        update(Event)
+        .where(tuple_(Event.event_id, Event.created_at).in_(due), Event.status == EventStatus.retrying)
+        .values(status=EventStatus.queued, next_attempt_at=None)
+        .returning(Event.event_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.commit()
+    event_cache.delete_many(requeued)
+    return requeued
+
+
+def process_due_retries_in_background() -> int:
+    """
+    Requeues due retries and processes them right away, for the API process in "background" mode where no worker picks them up.
+    """
+
+    db = SessionLocal()
+    try:
+        event_ids = requeue_due_retries(db)
+        return process_events(event_ids, db)
+    finally:
+        db.close()
+
+
+def redrive_dead_letters(db: Session, event_type=None, created_after=None, created_before=None, limit: int = 1000):
+    """
+    Moves up to `limit` dead-lettered events back to queued with a fresh set of attempts, returning their ids. The caller commits.
+    """
+
+    # (event_id, created_at) pairs, so the UPDATE finds each row in its own partition (see _process_batch)
+    redrivable = select(Event.event_id, Event.created_at).where(Event.status == EventStatus.dead_letter)
+    if event_type is not None:
+        redrivable = redrivable.where(Event.event_type == event_type)
+    if created_after is not None:
+        redrivable = redrivable.where(Event.created_at >= created_after)
+    if created_before is not None:
+        redrivable = redrivable.where(Event.created_at < created_before)
+
+    redriven = db.scalars(
+        update(Event)
+        .where(
+            tuple_(Event.event_id, Event.created_at).in_(
+                redrivable.order_by(Event.created_at).limit(limit).with_for_update(skip_locked=True)
+            ),
+            Event.status == EventStatus.dead_letter,
+        )
+        .values(status=EventStatus.queued, attempts=0, next_attempt_at=None, error_message=None)
+        .returning(Event.event_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+    # the notification makes every API process drop its cached (dead_letter) copy of these events
+    notify_status_changes(db, [(event_id, EventStatus.queued.value) for event_id in redriven])
+    return redriven
+
+
+def requeue_stale_events(db: Session, stale_after: float) -> int:
+    """
+    Schedules a retry for events that have been processing for longer than `stale_after` seconds.
+    """
+
+    # a worker that crashes or is killed after claiming leaves its events in processing forever, this hands them back to the retry schedule.
+    # it counts as a failed attempt, so an event that crashes every worker that touches it ends up dead-lettered instead of looping forever.
+    cutoff = datetime.utcnow() - timedelta(seconds=stale_after)
+    outcomes = _schedule_retries(
+        db,
+        and_(Event.status == EventStatus.processing, Event.updated_at < cutoff),
+        f"Processing did not finish within {stale_after:g} seconds",
+    )
+    db.commit()
+    event_cache.delete_many(event_id for event_id, _ in outcomes)
+    _count_outcomes(outcomes)
+    return len(outcomes)
+
+
+def recover_abandoned_events_in_background(stale_after: float, batch_size: int) -> int:
+    """
+    Retries events stuck in processing and processes events left queued, for the API process in "background" mode where no worker does it.
+    """
+
+    # in background mode an event is only processed by the BackgroundTask its request scheduled. when the process crashes or is stopped before
+    # that task finished, the event is left in processing (process_event commits that status first) or still queued, and nothing would pick it up.
+    # events queued for less than `stale_after` seconds are left alone, their BackgroundTask is most likely still coming.
+    db = SessionLocal()
+    try:
+        stale = requeue_stale_events(db, stale_after)
+        if stale:
+            logger.warning("Scheduled retries for %s stale events", stale)
 
-        raise
\ No newline at end of file
+        stale_before = datetime.utcnow() - timedelta(seconds=stale_after)
+        processed = 0
+        while True:
+            count = process_queued_events(db, batch_size, stale_before)
+            processed += count
+            if count < batch_size:
+                break
+        if processed:
+            logger.warning("Processed %s events left queued", processed)
+        return processed
+    finally:
+        db.close()
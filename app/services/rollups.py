@@ -0,0 +1,130 @@
+# ROLLUPS: pre-aggregated counts of processed events for dashboards, kept in event_stats_rollups (see app/db/models.py).
+# processing calls record_classifications with every result it stores, in the same transaction, so the counts are exact: a rolled back batch isn't counted
+# and a committed one is counted once. GET /events/stats reads them back with stats_query and summarize.
+import random
+from collections import Counter
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import BigInteger, cast, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.db.models import EventStatsRollup
+
+GRANULARITIES = ("minute", "hour")
+
+# how far back one stats request may reach per granularity: a day of minutes or a month of hours. the number of rows read is then bounded by
+# buckets * event types * severities, whatever the total number of events, so a dashboard refreshing every few seconds can't turn into a big scan.
+MAX_BUCKETS = {"minute": 24 * 60, "hour": 31 * 24}
+
+# rows each bucket's count is spread over (see EventStatsRollup.shard). a handful is enough for workers to rarely pick the same one,
+# and reads stay bounded as they sum at most this many rows per bucket and outcome.
+SHARDS = 8
+
+# the upsert of record_classifications, built once at import
+_insert = pg_insert(EventStatsRollup)
+_UPSERT = _insert.on_conflict_do_update(
+    index_elements=[
+        EventStatsRollup.granularity,
+        EventStatsRollup.bucket,
+        EventStatsRollup.event_type,
+        EventStatsRollup.severity,
+        EventStatsRollup.should_escalate,
+        EventStatsRollup.shard,
+    ],
+    set_={"count": EventStatsRollup.count + _insert.excluded.count},
+)
+
+
+def truncate(moment: datetime, granularity: str) -> datetime:
+    """
+    Returns the start of the minute or hour `moment` falls in.
+    """
+
+    if granularity == "minute":
+        return moment.replace(second=0, microsecond=0)
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def record_classifications(db: Session, classified: Iterable[Tuple[datetime, str, object, bool]]) -> None:
+    """
+    Adds (created_at, event_type, severity, should_escalate) of newly classified events to the rollup counts, without committing.
+    """
+
+    # a batch of 500 events mostly falls into a few buckets, so it is counted here first and costs one row per bucket and outcome instead of one per event
+    counts = Counter()
+    for created_at, event_type, severity, should_escalate in classified:
+        for granularity in GRANULARITIES:
+            counts[(granularity, truncate(created_at, granularity), event_type, severity, should_escalate)] += 1
+
+    if not counts:
+        return
+
+    # several workers add to the same current buckets at once and every row stays locked until the commit. a random shard per transaction
+    # mostly keeps them apart, and transactions that do pick the same shard lock its rows in the same (sorted) order: otherwise two batches
+    # could each hold a row the other one waits for and deadlock.
+    shard = random.randrange(SHARDS)
+    rows = [
+        {
+            "granularity": granularity,
+            "bucket": bucket,
+            "event_type": event_type,
+            "severity": severity,
+            "should_escalate": should_escalate,
+            "shard": shard,
+            "count": count,
+        }
+        for (granularity, bucket, event_type, severity, should_escalate), count in sorted(counts.items())
+    ]
+
+    # one INSERT ... ON CONFLICT DO UPDATE: a new bucket is created with the batch's count, an existing one gets the batch's count added to it.
+    # the rows are passed as parameters rather than .values(rows), so the statement compiles once and sqlalchemy's insertmanyvalues still sends them in one round trip
+    db.execute(_UPSERT, rows)
+
+
+def stats_query(granularity: str, since: datetime, until: datetime, event_type: Optional[str] = None):
+    """
+    Builds the SELECT of the rollup rows of one granularity between `since` (inclusive) and `until` (exclusive).
+    """
+
+    # granularity and bucket lead the primary key, so this is a range scan of the primary key index. the shards of every count are added up here
+    # (sum() of a bigint is a numeric in postgres, the cast keeps it an int in python)
+    columns = (
+        EventStatsRollup.bucket,
+        EventStatsRollup.event_type,
+        EventStatsRollup.severity,
+        EventStatsRollup.should_escalate,
+    )
+    query = (
+        select(*columns, cast(func.sum(EventStatsRollup.count), BigInteger).label("count"))
+        .where(
+            EventStatsRollup.granularity == granularity,
+            EventStatsRollup.bucket >= truncate(since, granularity),
+            EventStatsRollup.bucket < until,
+        )
+        .group_by(*columns)
+        .order_by(*columns)
+    )
+    if event_type is not None:
+        query = query.where(EventStatsRollup.event_type == event_type)
+    return query
+
+
+def summarize(rows) -> List[dict]:
+    """
+    Turns rollup rows into the buckets of the GET /events/stats response, with totals per severity and the escalation count of each bucket.
+    """
+
+    buckets = {}
+    for row in rows:
+        bucket = buckets.get(row.bucket)
+        if bucket is None:
+            bucket = buckets[row.bucket] = {"bucket": row.bucket, "total": 0, "escalated": 0, "by_severity": {}, "by_event_type": {}}
+        bucket["total"] += row.count
+        if row.should_escalate:
+            bucket["escalated"] += row.count
+        severity = row.severity.value
+        bucket["by_severity"][severity] = bucket["by_severity"].get(severity, 0) + row.count
+        bucket["by_event_type"][row.event_type] = bucket["by_event_type"].get(row.event_type, 0) + row.count
+    return list(buckets.values())
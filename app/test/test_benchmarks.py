@@ -0,0 +1,39 @@
+from app.benchmarks.common import compare, percentile, summarize_latencies
+
+
+def test_percentile_interpolates_between_ranks():
+    values = [1.0, 2.0, 3.0, 4.0]
+
+    assert percentile(values, 0) == 1.0
+    assert percentile(values, 50) == 2.5
+    assert percentile(values, 100) == 4.0
+    assert percentile([], 99) == 0.0
+
+
+def test_summarize_latencies_reports_throughput_and_milliseconds():
+    summary = summarize_latencies([0.001, 0.002, 0.003], elapsed=0.5)
+
+    assert summary["count"] == 3
+    assert summary["ops_per_sec"] == 6
+    assert round(summary["p50_ms"], 6) == 2.0
+    assert round(summary["max_ms"], 6) == 3.0
+
+
+def test_compare_flags_only_regressions_beyond_threshold():
+    baseline = {"api.post_event": {"ops_per_sec": 1000, "p99_ms": 10.0, "count": 100}}
+    current = {
+        "api.post_event": {"ops_per_sec": 850, "p99_ms": 10.5, "count": 50},
+        "api.new_endpoint": {"ops_per_sec": 1},
+    }
+
+    regressions = compare(current, baseline, threshold=0.1)
+
+    # throughput dropped 15%, p99 only rose 5%, count has no direction and new benchmarks have nothing to compare against
+    assert [(r["benchmark"], r["metric"]) for r in regressions] == [("api.post_event", "ops_per_sec")]
+
+
+def test_compare_treats_lower_latency_as_improvement():
+    baseline = {"processor.process_event": {"mean_us": 100.0, "events_per_sec": 10}}
+    current = {"processor.process_event": {"mean_us": 50.0, "events_per_sec": 20}}
+
+    assert compare(current, baseline, threshold=0.1) == []
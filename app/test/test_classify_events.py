@@ -0,0 +1,157 @@
+import math
+import random
+
+from app.services.rules import classify_event, classify_events, extract_hot_field, hot_payload
+
+# the batch path must give exactly the same answer as the scalar one, these checks compare both over hand-picked edge cases and random batches.
+
+EDGE_VALUES = [
+    0, 1, -1, 29, 30, 31, 999, 1000, 1001, 999.999, 1000.0, 30.0000001,
+    True, False, math.nan, math.inf, -math.inf, 2 ** 53, 2 ** 53 + 1, 2 ** 70, -(2 ** 70),
+]
+
+EVENT_TYPES = ["payment_failed", "sla_breach", "system_error", "unknown_type", ""]
+
+
+def _scalar_rows(event_types, payloads):
+    results = [classify_event(event_type, payload) for event_type, payload in zip(event_types, payloads)]
+    return [
+        (r.severity, r.classification_reason, r.recommendation, r.should_escalate)
+        for r in results
+    ]
+
+
+def _batch_rows(event_types, payloads):
+    columns = classify_events(event_types, payloads)
+    return list(zip(columns.severity, columns.classification_reason, columns.recommendation, columns.should_escalate))
+
+
+def _payload(value):
+    return {"amount": value, "minutes_over": value}
+
+
+def test_edge_values_match_scalar():
+    event_types = [event_type for event_type in EVENT_TYPES for _ in EDGE_VALUES]
+    payloads = [_payload(value) for _ in EVENT_TYPES for value in EDGE_VALUES]
+
+    assert _batch_rows(event_types, payloads) == _scalar_rows(event_types, payloads)
+
+
+def test_each_edge_value_alone_matches_scalar():
+    # a single-value batch keeps numpy's dtype for that value (int, float, bool) instead of a mixed upcast
+    for event_type in EVENT_TYPES:
+        for value in EDGE_VALUES:
+            payloads = [_payload(value)]
+            assert _batch_rows([event_type], payloads) == _scalar_rows([event_type], payloads), (event_type, value)
+
+
+def test_missing_fields_use_rule_default():
+    event_types = ["payment_failed", "sla_breach", "system_error"]
+    payloads = [{}, {}, {}]
+
+    assert _batch_rows(event_types, payloads) == _scalar_rows(event_types, payloads)
+
+
+def test_random_batches_match_scalar():
+    rng = random.Random(42)
+
+    for _ in range(50):
+        size = rng.randint(1, 500)
+        event_types = [rng.choice(EVENT_TYPES) for _ in range(size)]
+        payloads = []
+        for _ in range(size):
+            kind = rng.random()
+            if kind < 0.45:
+                value = rng.randint(-100, 3000)
+            elif kind < 0.9:
+                value = rng.uniform(-100, 3000)
+            else:
+                value = rng.choice(EDGE_VALUES)
+            payloads.append({} if rng.random() < 0.05 else _payload(value))
+
+        assert _batch_rows(event_types, payloads) == _scalar_rows(event_types, payloads)
+
+
+def test_empty_batch():
+    columns = classify_events([], [])
+
+    assert columns.severity == [] and columns.should_escalate == []
+
+
+def test_results_keep_input_order():
+    event_types = ["sla_breach", "payment_failed", "sla_breach", "payment_failed"]
+    payloads = [{"minutes_over": 45}, {"amount": 10}, {"minutes_over": 5}, {"amount": 5000}]
+
+    columns = classify_events(event_types, payloads)
+
+    assert columns.should_escalate == [True, False, False, True]
+
+
+def test_invalid_values_raise_like_scalar():
+    # non-numeric values can't be compared in python either, both paths must raise instead of guessing a result
+    for value in ["1500", None, [1, 2], {"x": 1}]:
+        payloads = [{"amount": 5}, {"amount": value}]
+
+        try:
+            _scalar_rows(["payment_failed", "payment_failed"], payloads)
+        except TypeError:
+            pass
+        else:
+            raise AssertionError(f"scalar path accepted {value!r}")
+
+        try:
+            _batch_rows(["payment_failed", "payment_failed"], payloads)
+        except TypeError:
+            pass
+        else:
+            raise AssertionError(f"batch path accepted {value!r}")
+
+
+def test_to_rows_builds_result_rows():
+    columns = classify_events(["system_error"], [{}])
+
+    rows = columns.to_rows(["event-1"])
+
+    assert rows == [{
+        "event_id": "event-1",
+        "severity": columns.severity[0],
+        "classification_reason": "System error detected",
+        "recommendation": "Investigate system logs immediately",
+        "should_escalate": True,
+    }]
+
+
+def test_hot_fields_classify_like_full_payload():
+    # whatever extract_hot_field stores at ingest, classifying from it must give the same result as the payload it came from
+    payloads = [_payload(value) for value in EDGE_VALUES] + [{}, {"amount": "1500", "minutes_over": None}, {"amount": [1], "minutes_over": {}}]
+
+    for event_type in EVENT_TYPES:
+        for payload in payloads:
+            rebuilt = hot_payload(event_type, *extract_hot_field(event_type, payload))
+            used = payload if rebuilt is None else rebuilt
+            assert _outcome(_batch_rows, event_type, used) == _outcome(_scalar_rows, event_type, payload), (event_type, payload)
+
+
+def _outcome(classify, event_type, payload):
+    # the rows, or the type of error raised for values the rules can't compare
+    try:
+        return classify([event_type], [payload])
+    except Exception as e:
+        return type(e)
+
+
+def test_hot_fields_only_hold_exact_numbers():
+    assert extract_hot_field("payment_failed", {"amount": 1500}) == ("amount", 1500.0)
+    assert extract_hot_field("payment_failed", {}) == ("amount", None)
+    assert extract_hot_field("payment_failed", {"amount": "1500"}) == (None, None)
+    assert extract_hot_field("payment_failed", {"amount": True}) == (None, None)
+    assert extract_hot_field("payment_failed", {"amount": 2 ** 53 + 1}) == (None, None)
+    assert extract_hot_field("system_error", {"code": 500}) == ("", None)
+
+
+def test_hot_payload_needs_matching_field():
+    # a hot value taken from another field (the rules file changed after ingest) can't stand in for the payload
+    assert hot_payload("payment_failed", "minutes_over", 45.0) is None
+    assert hot_payload("payment_failed", None, None) is None
+    assert hot_payload("payment_failed", "amount", 1500.0) == {"amount": 1500.0}
+    assert hot_payload("payment_failed", "amount", None) == {}
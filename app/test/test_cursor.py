@@ -0,0 +1,26 @@
+import base64
+import uuid
+from datetime import datetime
+
+import pytest
+
+from app.api.events import _decode_cursor, _encode_cursor
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2026, 10, 18, 12, 30, 15, 123456)
+    event_id = uuid.uuid4()
+
+    assert _decode_cursor(_encode_cursor(created_at, event_id)) == (created_at, event_id)
+
+
+def test_timezone_aware_cursor_is_converted_to_naive_utc():
+    event_id = uuid.uuid4()
+    cursor = base64.urlsafe_b64encode(f"2026-10-18T12:00:00+02:00|{event_id}".encode()).decode()
+
+    assert _decode_cursor(cursor) == (datetime(2026, 10, 18, 10, 0), event_id)
+
+
+def test_malformed_cursor_is_rejected():
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        _decode_cursor("not a cursor")
@@ -0,0 +1,32 @@
+import uuid
+from datetime import datetime
+
+from app.services.event_ids import created_at_range, new_event_id
+
+
+def test_new_event_id_is_a_uuid7():
+    event_id = new_event_id(datetime(2026, 10, 18, 12, 30, 15, 123456))
+
+    assert event_id.version == 7
+    assert event_id.variant == uuid.RFC_4122
+    assert new_event_id(datetime(2026, 10, 18)) != new_event_id(datetime(2026, 10, 18))
+
+
+def test_created_at_range_holds_the_created_at():
+    created_at = datetime(2026, 10, 18, 12, 30, 15, 123456)
+
+    start, end = created_at_range(new_event_id(created_at))
+
+    assert start == datetime(2026, 10, 18, 12, 30, 15, 123000)
+    assert start <= created_at < end
+
+
+def test_ids_sort_by_created_at():
+    earlier = new_event_id(datetime(2026, 1, 31, 23, 59, 59, 999999))
+    later = new_event_id(datetime(2026, 2, 1))
+
+    assert earlier < later
+
+
+def test_random_ids_have_no_range():
+    assert created_at_range(uuid.uuid4()) is None
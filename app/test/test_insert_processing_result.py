@@ -2,7 +2,7 @@ import uuid
 from datetime import datetime
 
 from app.db.session import SessionLocal
-from app.db.models import EventProcessingResult, SeverityLevel
+from app.db.models import Event, EventProcessingResult, SeverityLevel
 
 # event_id column in table is UUID type and doesnt expect strings rather uuid objects. so we convert the event id string generated during event insertion to uuid object here.
 EVENT_ID = uuid.UUID("21a9b780-1015-46c4-8992-cf80d3ea44a0")
@@ -12,8 +12,12 @@ def insert_processing_result():
     db = SessionLocal()
 
     try:
+        # results are stored next to their event's month, so the event's created_at is part of the result's key
+        event = db.query(Event).filter(Event.event_id == EVENT_ID).first()
+
         result = EventProcessingResult(
             event_id=EVENT_ID,
+            event_created_at=event.created_at,
             severity=SeverityLevel.critical,
             classification_reason="Payment amount exceeded critical threshold",
             recommendation="Escalate to finance team immediately",
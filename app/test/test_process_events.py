@@ -0,0 +1,35 @@
+from app.db.session import SessionLocal
+from app.db.models import Event, EventStatus
+from app.services.processor import process_events
+
+
+def run_batch_processor_test():
+    db = SessionLocal()
+
+    try:
+        # 1. Fetch up to 100 queued events
+        event_ids = [
+            event.event_id
+            for event in db.query(Event).filter(Event.status == EventStatus.queued).limit(100)
+        ]
+
+        if not event_ids:
+            print("No queued events found to process")
+            return
+
+        print("Processing events:", len(event_ids))
+
+        # 2. Call batch processor, it claims, classifies and stores the whole batch in one transaction
+        processed = process_events(event_ids, db)
+
+        print("Processing completed for", processed, "events")
+
+    except Exception as e:
+        print("Error during batch processing:", e)
+
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    run_batch_processor_test()
@@ -0,0 +1,83 @@
+import multiprocessing
+import os
+import signal
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, select
+
+from app.db.models import Event, EventProcessingResult, EventStatus
+from app.db.session import SessionLocal, engine
+from app.services import processor
+from app.services.event_ids import new_event_id
+
+
+def _new_event(db, updated_at=None):
+    created_at = datetime.utcnow()
+    event = Event(
+        event_id=new_event_id(created_at),
+        created_at=created_at,
+        event_type="payment_failed",
+        source="test_recovery",
+        status=EventStatus.queued,
+        payload={"amount": 1500},
+        updated_at=updated_at or created_at,
+    )
+    db.add(event)
+    db.commit()
+    return event.event_id
+
+
+def _process_and_hang(event_id):
+    # runs in a forked child: the rules never return, so the event stays in processing until the child is killed
+    engine.dispose(close=False)
+    processor.classify_event = lambda *_: time.sleep(60)
+    processor.process_event(event_id, SessionLocal())
+
+
+def _status(db, event_id):
+    db.expire_all()
+    return db.scalar(select(Event.status).where(Event.event_id == event_id))
+
+
+def test_events_of_a_killed_process_are_processed_eventually():
+    db = SessionLocal()
+    try:
+        db.execute(select(1))
+    except Exception:
+        db.close()
+        pytest.skip("needs the database of EVENTFLO_DATABASE_URL")
+
+    event_ids = []
+    try:
+        # an event whose BackgroundTask never ran, e.g. the server was stopped before it got to it
+        event_ids.append(_new_event(db, updated_at=datetime.utcnow() - timedelta(minutes=1)))
+
+        # an event whose processing is killed mid-flight, after process_event committed the processing status
+        event_ids.append(_new_event(db))
+        child = multiprocessing.get_context("fork").Process(target=_process_and_hang, args=(event_ids[1],))
+        child.start()
+        deadline = time.monotonic() + 10
+        while _status(db, event_ids[1]) != EventStatus.processing and time.monotonic() < deadline:
+            time.sleep(0.05)
+        os.kill(child.pid, signal.SIGKILL)
+        child.join()
+        assert _status(db, event_ids[1]) == EventStatus.processing
+
+        # what the API's retry scheduler does in background mode, with a short stale_after: the stuck event is retried after its backoff
+        deadline = time.monotonic() + 15
+        while time.monotonic() < deadline:
+            time.sleep(0.5)
+            processor.recover_abandoned_events_in_background(0.5, 100)
+            processor.process_due_retries_in_background()
+            if all(_status(db, event_id) == EventStatus.completed for event_id in event_ids):
+                break
+
+        assert [_status(db, event_id) for event_id in event_ids] == [EventStatus.completed, EventStatus.completed]
+    finally:
+        db.rollback()
+        db.execute(delete(EventProcessingResult).where(EventProcessingResult.event_id.in_(event_ids)))
+        db.execute(delete(Event).where(Event.event_id.in_(event_ids)))
+        db.commit()
+        db.close()
@@ -0,0 +1,34 @@
+from collections import namedtuple
+from datetime import datetime
+
+from app.db.models import SeverityLevel
+from app.services.rollups import summarize, truncate
+
+Row = namedtuple("Row", "bucket event_type severity should_escalate count")
+
+
+def test_truncate_to_minute_and_hour():
+    moment = datetime(2024, 5, 1, 12, 34, 56, 789)
+
+    assert truncate(moment, "minute") == datetime(2024, 5, 1, 12, 34)
+    assert truncate(moment, "hour") == datetime(2024, 5, 1, 12)
+
+
+def test_summarize_adds_up_rows_of_a_bucket():
+    first = datetime(2024, 5, 1, 12)
+    second = datetime(2024, 5, 1, 13)
+    rows = [
+        Row(first, "payment_failed", SeverityLevel.high, True, 3),
+        Row(first, "payment_failed", SeverityLevel.low, False, 5),
+        Row(first, "sla_breach", SeverityLevel.high, True, 2),
+        Row(second, "system_error", SeverityLevel.critical, True, 1),
+    ]
+
+    buckets = summarize(rows)
+
+    assert [bucket["bucket"] for bucket in buckets] == [first, second]
+    assert buckets[0]["total"] == 10
+    assert buckets[0]["escalated"] == 5
+    assert buckets[0]["by_severity"] == {"HIGH": 5, "LOW": 5}
+    assert buckets[0]["by_event_type"] == {"payment_failed": 8, "sla_breach": 2}
+    assert buckets[1]["by_severity"] == {"CRITICAL": 1}
@@ -0,0 +1,84 @@
+import copy
+import json
+
+import pytest
+
+from app.config import settings
+from app.db.models import SeverityLevel
+from app.services.rules import classify_event, compile_rules
+
+with open(settings.rules_path) as f:
+    DEFINITIONS = json.load(f)
+
+
+def _legacy_classify(event_type, payload):
+    # the hard-coded if/elif chain the rules file replaced, kept here to check the compiled rules still give the same answers
+    if event_type == "payment_failed":
+        if payload.get("amount", 0) >= 1000:
+            return (SeverityLevel.critical, "Payment amount is greater than or equal to 1000", "Escalate to finance team immediately", True)
+        return (SeverityLevel.high, "Payment failed but amount is below critical threshold", "Notify customer and retry payment", False)
+    elif event_type == "sla_breach":
+        if payload.get("minutes_over", 0) >= 30:
+            return (SeverityLevel.high, "SLA breached by more than 30 minutes", "Alert operations team", True)
+        return (SeverityLevel.warning, "Minor SLA breach", "Log incident and monitor", False)
+    elif event_type == "system_error":
+        return (SeverityLevel.critical, "System error detected", "Investigate system logs immediately", True)
+    return (SeverityLevel.low, "Unknown event type", "No action required", False)
+
+
+def _outcome(classify, event_type, payload):
+    # the result as a tuple, or the type of error raised for values that can't be compared with a number
+    try:
+        result = classify(event_type, payload)
+    except Exception as e:
+        return type(e)
+    if isinstance(result, tuple):
+        return result
+    return (result.severity, result.classification_reason, result.recommendation, result.should_escalate)
+
+
+def _broken(event_type, change):
+    definitions = copy.deepcopy(DEFINITIONS)
+    change(definitions["rules"][event_type])
+    return definitions
+
+
+@pytest.mark.parametrize("value", [999, 1000, 999.99, 1000.0, 1001, 0, -5, 29, 30, 29.5, 31, True, False, None, "1000", "abc", [1], {}])
+@pytest.mark.parametrize("event_type", ["payment_failed", "sla_breach", "system_error", "unknown_type"])
+def test_compiled_rules_match_legacy_chain(event_type, value):
+    payload = {"amount": value, "minutes_over": value}
+
+    assert _outcome(classify_event, event_type, payload) == _outcome(_legacy_classify, event_type, payload)
+
+
+@pytest.mark.parametrize("event_type", ["payment_failed", "sla_breach", "system_error", "unknown_type"])
+def test_missing_field_matches_legacy_chain(event_type):
+    assert _outcome(classify_event, event_type, {}) == _outcome(_legacy_classify, event_type, {})
+
+
+def test_thresholds_without_field_are_rejected():
+    definitions = _broken("payment_failed", lambda rule: rule.pop("field"))
+
+    with pytest.raises(ValueError, match="Invalid rule for event type 'payment_failed'"):
+        compile_rules(definitions)
+
+
+def test_missing_otherwise_is_rejected():
+    definitions = _broken("system_error", lambda rule: rule.pop("otherwise"))
+
+    with pytest.raises(ValueError, match="Invalid rule for event type 'system_error'"):
+        compile_rules(definitions)
+
+
+def test_unknown_severity_is_rejected():
+    definitions = _broken("sla_breach", lambda rule: rule["thresholds"][0].update(severity="URGENT"))
+
+    with pytest.raises(ValueError, match="Invalid rule for event type 'sla_breach'"):
+        compile_rules(definitions)
+
+
+def test_rules_file_compiles():
+    rules, fallback = compile_rules(DEFINITIONS)
+
+    assert set(rules) == {"payment_failed", "sla_breach", "system_error"}
+    assert fallback.severity == SeverityLevel.low
@@ -0,0 +1,165 @@
+# WORKER: standalone process that processes queued events outside of the API, run it with `python -m app.worker`.
+# the API only stores events as queued, and any number of these workers (on one host or many) claim and process them straight from the events table.
+# as the queue lives in postgres, nothing is lost when the API or a worker restarts, queued events simply wait for the next worker.
+import argparse
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+
+from prometheus_client import start_http_server
+
+from app.config import settings
+from app.db.session import SessionLocal, engine
+from app.services.processor import process_queued_events, requeue_due_retries, requeue_stale_events
+
+logger = logging.getLogger("eventflo.worker")
+
+
+class Worker:
+    """
+    Runs a pool of threads that claim and process queued events until stopped.
+    """
+
+    def __init__(self, threads: int, batch_size: int, poll_interval: float, stale_after: float, retry_poll_interval: float):
+        self.threads = threads
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.retry_poll_interval = retry_poll_interval
+        # threading.Event is a thread-safe flag, setting it tells every thread to finish its current batch and exit.
+        self.stop_event = threading.Event()
+
+    def run(self):
+        pool = [
+            threading.Thread(target=self._loop, name=f"eventflo-worker-{i}")
+            for i in range(self.threads)
+        ]
+        for thread in pool:
+            thread.start()
+
+        # the main thread only does housekeeping: it is the retry scheduler, moving every due retry back to the queue with one UPDATE per tick
+        # (the threads then claim them like any other queued event), and every now and then it hands events of crashed workers to the retry schedule.
+        last_stale_check = time.monotonic()
+        while not self.stop_event.wait(self.retry_poll_interval):
+            self._requeue_due_retries()
+            if time.monotonic() - last_stale_check >= self.stale_after / 2:
+                self._requeue_stale()
+                last_stale_check = time.monotonic()
+
+        for thread in pool:
+            thread.join()
+
+    def stop(self, *_):
+        self.stop_event.set()
+
+    def _loop(self):
+        # one session per thread, sessions must never be shared between threads.
+        db = SessionLocal()
+
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    # claims, classifies and stores a whole batch in one transaction, a failing event only marks itself failed
+                    processed = process_queued_events(db, self.batch_size)
+                except Exception:
+                    logger.exception("Failed to process a batch of queued events")
+                    db.rollback()
+                    self.stop_event.wait(self.poll_interval)
+                    continue
+
+                # nothing to do, sleep a bit instead of hammering the db with empty claims
+                if not processed:
+                    self.stop_event.wait(self.poll_interval)
+        finally:
+            db.close()
+
+    def _requeue_due_retries(self):
+        db = SessionLocal()
+        try:
+            requeued = requeue_due_retries(db)
+            if requeued:
+                logger.info("Requeued %s events due for a retry", len(requeued))
+        except Exception:
+            logger.exception("Failed to requeue due retries")
+            db.rollback()
+        finally:
+            db.close()
+
+    def _requeue_stale(self):
+        db = SessionLocal()
+        try:
+            count = requeue_stale_events(db, self.stale_after)
+            if count:
+                logger.warning("Scheduled retries for %s stale events", count)
+        except Exception:
+            logger.exception("Failed to requeue stale events")
+            db.rollback()
+        finally:
+            db.close()
+
+
+def run_worker(threads: int, batch_size: int, poll_interval: float, stale_after: float, retry_poll_interval: float, metrics_port: int = 0):
+    # a forked child inherits the parent's pooled connections, dispose(close=False) drops them without closing the sockets the parent still owns.
+    engine.dispose(close=False)
+
+    # workers don't run the API, so they serve their processing metrics (stage timings, queue wait, pool waits) on their own small HTTP server
+    if metrics_port:
+        start_http_server(metrics_port)
+        logger.info("Serving metrics on port %s", metrics_port)
+
+    worker = Worker(threads, batch_size, poll_interval, stale_after, retry_poll_interval)
+    # SIGTERM (docker/systemd stop) and Ctrl+C both drain the worker gracefully instead of killing it mid-batch
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EventFlo event processing worker")
+    parser.add_argument("--threads", type=int, default=settings.worker_threads)
+    parser.add_argument("--processes", type=int, default=settings.worker_processes)
+    parser.add_argument("--batch-size", type=int, default=settings.worker_batch_size)
+    parser.add_argument("--poll-interval", type=float, default=settings.worker_poll_interval)
+    parser.add_argument("--stale-after", type=float, default=settings.worker_stale_after)
+    parser.add_argument("--retry-poll-interval", type=float, default=settings.retry_poll_interval)
+    parser.add_argument("--metrics-port", type=int, default=settings.worker_metrics_port)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(threadName)s %(levelname)s %(message)s")
+    worker_args = (args.threads, args.batch_size, args.poll_interval, args.stale_after, args.retry_poll_interval)
+
+    if args.processes <= 1:
+        run_worker(*worker_args, args.metrics_port)
+        return
+
+    # several processes get around the GIL when classification becomes CPU bound, each one runs its own thread pool.
+    # each process serves its own metrics on the next port, prometheus scrapes them all.
+    processes = [
+        multiprocessing.Process(
+            target=run_worker,
+            args=(*worker_args, args.metrics_port + i if args.metrics_port else 0),
+            name=f"eventflo-worker-process-{i}",
+        )
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+
+    # SIGTERM sent to the parent is passed on to every child so they drain gracefully,
+    # Ctrl+C already reaches every child in the foreground process group so the parent itself ignores it.
+    def forward_sigterm(*_):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, forward_sigterm)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()